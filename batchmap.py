@@ -0,0 +1,189 @@
+""" Many games played in lockstep, as one set of arrays, for self-play and
+parameter searches.  Needs NumPy.
+
+A BatchMap keeps the boards of N games as (N, width, height) int32 arrays of
+each player's guys, and each player's food and money as arrays of N, so a
+turn of every game at once is a few array operations.  Each game follows the
+rules of map.Map exactly and ends up with the same money to the last bit as
+the same game played on its own Map (game(i) gives game i as a Map).
+
+Orders are given for every game at once, for each player, as either
+
+    an (N, width, height, 5) integer array of how many guys each cell sends
+    each way, indexed by direction (a histogram, as in orders.py), or
+    an array of (game, x, y, direction, quantity) records.
+
+None is no orders.  Orders are checked the same way as on a Map.
+
+python batchmap.py --games 256
+"""
+import time
+import argparse
+
+import numpy as np
+
+import actions
+from map import Map
+
+# Guys and orders are kept as int32, which halves the memory each step has to
+# get through.  No game gets near this many guys, so any order for more can
+# only be dropped anyway.
+MAX_GUYS = np.iinfo(np.int32).max
+
+
+class BatchMap:
+    """ The boards of len(seeds) games, game i on the map made from seeds[i] """
+    def __init__(self, seeds, num_hills=4, hill_size=30, cache_dir=None,
+                 width=Map.WIDTH, height=Map.HEIGHT):
+        maps = [Map(num_hills, hill_size, seed, cache_dir, width, height, sparse=False)
+                for seed in seeds]
+        self.num_games = len(maps)
+        self.width, self.height = width, height
+        self.money_payout_rates = [m.money_payout_rates for m in maps]
+        self.p1_spawns = np.array([m.p1_spawn for m in maps], dtype=np.int64).reshape(-1, 2)
+        self.p2_spawns = np.array([m.p2_spawn for m in maps], dtype=np.int64).reshape(-1, 2)
+        rates = np.array(self.money_payout_rates, dtype=np.float64).reshape(-1, width, height)
+        self.milli_array = np.round(1000 * rates).astype(np.int64)
+        self.p1_guys = np.zeros((self.num_games, width, height), dtype=np.int32)
+        self.p2_guys = np.zeros((self.num_games, width, height), dtype=np.int32)
+        self.p1_food = np.full(self.num_games, Map.STARTING_FOOD, dtype=np.float64)
+        self.p2_food = np.full(self.num_games, Map.STARTING_FOOD, dtype=np.float64)
+        self.p1_money = np.full(self.num_games, Map.STARTING_MONEY, dtype=np.float64)
+        self.p2_money = np.full(self.num_games, Map.STARTING_MONEY, dtype=np.float64)
+
+    def play_turn(self, p1_orders, p2_orders):
+        """ Play a whole turn of every game, the way game.run_game does """
+        self.apply_moves(p1_orders, p2_orders)
+        self.resolve_combat()
+        self.give_payouts()
+        self.spawn_new_guys()
+        self.resolve_combat()
+
+    def apply_moves(self, p1_orders, p2_orders):
+        requested = self.__requested(p1_orders)
+        if requested is not None:
+            self.p1_guys = self.__moved(self.p1_guys, requested)
+        requested = self.__requested(p2_orders)
+        if requested is not None:
+            self.p2_guys = self.__moved(self.p2_guys, requested)
+
+    def __moved(self, guys, requested):
+        """ The guys after the moves of requested are made the orders.py way,
+        like numpymap.moved_guys but with each direction's orders in one
+        block of memory: nothing goes off the board, and each cell's
+        directions are taken in the order of actions.ALL_ACTIONS while there
+        are enough guys left. """
+        requested[actions.UP, :, :, -1] = 0
+        requested[actions.DOWN, :, :, 0] = 0
+        requested[actions.RIGHT, :, -1, :] = 0
+        requested[actions.LEFT, :, 0, :] = 0
+        remaining = guys.copy()
+        for direction in actions.ALL_ACTIONS:
+            moving = requested[direction]
+            np.copyto(moving, 0, where=moving > remaining)
+            remaining -= moving
+
+        moved = remaining
+        moved += requested[actions.STAY]
+        moved[:, 1:, :] += requested[actions.RIGHT, :, :-1, :]
+        moved[:, :-1, :] += requested[actions.LEFT, :, 1:, :]
+        moved[:, :, 1:] += requested[actions.UP, :, :, :-1]
+        moved[:, :, :-1] += requested[actions.DOWN, :, :, 1:]
+        return moved
+
+    def __requested(self, player_orders):
+        """ A (5, N, width, height) int32 array of how many guys each cell of
+        each game asks to send each way, without the orders Map would drop,
+        or None for no orders """
+        if player_orders is None:
+            return None
+        player_orders = np.asarray(player_orders)
+        shape = (self.num_games, self.width, self.height, len(actions.ALL_ACTIONS))
+        if player_orders.dtype.kind not in 'iu':
+            raise ValueError('orders must be whole numbers')
+        if player_orders.shape == shape:
+            if player_orders.dtype.itemsize > 4 and player_orders.max() > MAX_GUYS:
+                player_orders = np.minimum(player_orders, MAX_GUYS)
+            # Turned direction first and made int32 in the same pass
+            requested = np.empty((len(actions.ALL_ACTIONS),) + shape[:3], dtype=np.int32)
+            return np.maximum(np.moveaxis(player_orders, -1, 0), 0, out=requested,
+                              casting='unsafe')
+        if player_orders.size == 0:
+            return None
+        if player_orders.ndim != 2 or player_orders.shape[1] != 5:
+            raise ValueError('orders must be a histogram of shape %s or '
+                             '(game, x, y, direction, quantity) records' % (shape,))
+        games, xs, ys, directions, quantities = player_orders.T
+        keep = (games >= 0) & (games < self.num_games) & \
+               (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height) & \
+               (directions >= 0) & (directions < len(actions.ALL_ACTIONS)) & (quantities > 0)
+        games, xs, ys, directions, quantities = player_orders[keep].T
+        requested = np.zeros((len(actions.ALL_ACTIONS),) + shape[:3], dtype=np.int64)
+        np.add.at(requested, (directions, games, xs, ys), quantities)
+        return np.minimum(requested, MAX_GUYS).astype(np.int32)
+
+    def resolve_combat(self):
+        num_dead = np.minimum(self.p1_guys, self.p2_guys)
+        self.p1_guys -= num_dead
+        self.p2_guys -= num_dead
+
+    def give_payouts(self):
+        # In thousandths, like Map, so the money comes out exactly the same
+        p1_owned = self.p1_guys != 0
+        p2_owned = ~p1_owned & (self.p2_guys != 0)
+        for owned, money, food in ((p1_owned, self.p1_money, self.p1_food),
+                                   (p2_owned, self.p2_money, self.p2_food)):
+            milli_money = (self.milli_array * owned).sum(axis=(1, 2))
+            num_owned = owned.sum(axis=(1, 2), dtype=np.int64)
+            money += milli_money / 1000.0
+            food += (1000 * num_owned - milli_money) / 1000.0
+
+    def spawn_new_guys(self):
+        games = np.arange(self.num_games)
+        for guys, food, spawns in ((self.p1_guys, self.p1_food, self.p1_spawns),
+                                   (self.p2_guys, self.p2_food, self.p2_spawns)):
+            # int(log(food)) guys for num_guys**1.1 food, as in Map
+            num_guys = np.where(food < 1.0, 0, np.log(np.maximum(food, 1.0))).astype(np.int64)
+            food -= np.where(num_guys > 0, num_guys.astype(np.float64) ** 1.1, 0.0)
+            guys[games, spawns[:, 0], spawns[:, 1]] += num_guys.astype(np.int32)
+
+    def game(self, i):
+        """ Game i as a Map """
+        m = Map(width=self.width, height=self.height, sparse=False,
+                layout=(self.money_payout_rates[i], tuple(self.p1_spawns[i].tolist()),
+                        tuple(self.p2_spawns[i].tolist())))
+        m.set_guys(self.p1_guys[i].tolist(), self.p2_guys[i].tolist())
+        m.p1_food, m.p2_food = float(self.p1_food[i]), float(self.p2_food[i])
+        m.p1_money, m.p2_money = float(self.p1_money[i]), float(self.p2_money[i])
+        return m
+
+
+def random_orders(guys, rng):
+    """ Histogram orders for every game that send half the guys on each cell
+    one way, picked at random for each cell.  For trying the batch out. """
+    requested = np.zeros(guys.shape + (len(actions.ALL_ACTIONS),), dtype=np.int32)
+    directions = rng.randint(len(actions.ALL_ACTIONS), size=guys.shape)
+    np.put_along_axis(requested, directions[..., np.newaxis], (guys // 2)[..., np.newaxis], axis=-1)
+    return requested
+
+
+if __name__ == '__main__':
+    import game
+
+    parser = argparse.ArgumentParser(description='Time a batch of games of random orders.')
+    parser.add_argument('--games', type=int, default=256, help='games in the batch')
+    parser.add_argument('--turns', type=int, default=game.NUM_TURNS)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    start = time.time()
+    batch = BatchMap(range(args.games))
+    made = time.time()
+    for turn in range(args.turns):
+        batch.play_turn(random_orders(batch.p1_guys, rng), random_orders(batch.p2_guys, rng))
+    played = time.time()
+    print 'Made %d maps in %.1fs, played %d turns in %.1fs: %.1f games a second' % (
+        args.games, made - start, args.turns, played - made,
+        args.games * args.turns / float(game.NUM_TURNS) / (played - made))
+    print 'Player 1 won %d, player 2 won %d' % (
+        (batch.p1_money > batch.p2_money).sum(), (batch.p2_money > batch.p1_money).sum())
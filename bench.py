@@ -0,0 +1,386 @@
+""" Benchmarks for the engine and the bundled bots.
+
+python bench.py                  run everything and compare with bench_baseline.json
+python bench.py --save-baseline  run everything and make that the new baseline
+python bench.py --only late      run just the benchmarks with "late" in the name
+python bench.py --record-states  play a game to make bench_states.json again
+
+Each board state in bench_states.json (early, mid and late in a game between
+phoglenix3 and phoglenix2), plus a made-up board of 100,000 chickens, is put
+through every phase of a turn on each engine, through the take_turn of every
+bundled bot, and through a turn of look-ahead on the board a bot sees
+(Map.from_guys, play_turn and undo_turn).  Every call starts from a freshly
+loaded board (and a new bot), and only the call itself is timed.
+
+Per-call latency percentiles and the most the process's resident size grew
+during a call are printed.  A benchmark whose median is more than
+--tolerance times its baseline median (and slower by more than a little
+noise), or whose memory grew by much more than before, is a regression: they
+are all listed and the exit status is 1.
+
+Every run also times a fixed loop of plain Python (the median of several
+goes of a few tens of milliseconds each, before and after the benchmarks,
+averaged), and the baseline times are scaled by how much faster or slower
+that loop ran than when the baseline was saved, so a busy machine doesn't
+look like a regression.  Each baseline keeps the calibration it was
+measured with, so saving just some of them leaves the rest as they were.
+A benchmark also has to be slower by more than the
+spread of its own timings (p90 - p50, now or in the baseline) to count.
+Even so, baselines only mean something on the machine they were saved on,
+so none comes with the game: save one with --save-baseline before making
+changes. """
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import importlib
+
+import game
+import actions
+from map import Map, DENSE, SPARSE, ARRAYS
+from profiler import resident_kb, percentile
+
+STATES_PATH = 'bench_states.json'
+BASELINE_PATH = 'bench_baseline.json'
+BOTS = ['dumbplayer', 'randomplayer', 'phoglenix', 'phoglenix2', 'phoglenix3']
+PHASES = ['turn_data_dense', 'turn_data_sparse', 'turn_data_arrays',
+          'apply_moves', 'apply_moves_records', 'resolve_combat',
+          'give_payouts', 'spawn_new_guys', 'board_state_for_json']
+# Differences smaller than these are noise, whatever the ratio
+NOISE_MS = 0.05
+NOISE_KB = 1024
+# How far apart the calibrations before and after the benchmarks can be
+# before the machine's speed is said to have changed during the run
+CALIBRATION_DRIFT = 0.1
+
+
+def record_states(path, seed=1, turns=(50, 400, 950)):
+    """ Play phoglenix3 against phoglenix2 and save the board at the given
+    turns as the early, mid and late states """
+    random.seed(seed)
+    m = Map(seed=seed)
+    import phoglenix3, phoglenix2
+    p1 = phoglenix3.Player(*m.constructor_data_for_p1(phoglenix3.Player.MAP_ANALYSIS))
+    p2 = phoglenix2.Player(*m.constructor_data_for_p2())
+    states = {}
+    names = dict(zip(turns, ['early', 'mid', 'late']))
+
+    class Recorder:
+        """ Stands in for a game log, keeping the turns we want """
+        def __init__(self):
+            self.turn_no = -1
+        def write_turn(self, state):
+            self.turn_no += 1
+            if self.turn_no in names:
+                state = dict(state, seed=seed, turn=self.turn_no,
+                             p1f=m.p1_food, p2f=m.p2_food)
+                states[names[self.turn_no]] = state
+        def write_orders(self, p1_actions, p2_actions):
+            pass
+        def write_profile(self, summary):
+            pass
+
+    game.NUM_TURNS = max(turns)
+    game.run_game(m, p1, p2, log=Recorder())
+    with open(path, 'w') as f:
+        json.dump(states, f, separators=(',', ':'), sort_keys=True)
+
+
+def crowded_state(seed=1, chickens=100000):
+    """ A board with half the chickens spread evenly over each player's half """
+    width, height = Map.WIDTH, Map.HEIGHT
+    cells = width / 2 * height
+    per_cell = chickens / 2 / cells
+    p1g = [[x, y, per_cell] for x in range(width / 2) for y in range(height)]
+    p2g = [[x, y, per_cell] for x in range(width / 2, width) for y in range(height)]
+    return {'seed': seed, 'turn': 500, 'p1m': 1000.0, 'p2m': 1000.0,
+            'p1f': 1000.0, 'p2f': 1000.0, 'p1g': p1g, 'p2g': p2g}
+
+
+def load_state(m, state):
+    """ Put a saved board state onto map m """
+    grids = []
+    for cells in (state['p1g'], state['p2g']):
+        grid = [[0] * m.height for x in range(m.width)]
+        for x, y, n in cells:
+            grid[x][y] = n
+        grids.append(grid)
+    m.set_guys(*grids)
+    m.p1_money, m.p2_money = state['p1m'], state['p2m']
+    m.p1_food, m.p2_food = state['p1f'], state['p2f']
+
+
+def some_orders(cells, seed=0):
+    """ Repeatable orders moving about half the guys of each cell """
+    rand = random.Random(seed)
+    orders = {}
+    for x, y, n in cells:
+        orders[(x, y), rand.choice(actions.ALL_ACTIONS)] = (n + 1) / 2
+    return orders
+
+
+class Benchmarks:
+    def __init__(self, states, engines, repeat, only=None):
+        self.states = states
+        self.engines = engines
+        self.repeat = repeat
+        self.only = only
+        self.results = {}
+
+    def run(self, name, setup, call):
+        """ Time call(*setup()) repeat times, printing and keeping the results """
+        if self.only and self.only not in name:
+            return
+        # One call first to warm up (imports, caches), then the timed calls,
+        # each without the garbage collector going off part way through
+        call(*setup())
+        times = []
+        grown = 0
+        for i in range(self.repeat):
+            args = setup()
+            gc.collect()
+            gc.disable()
+            start_kb = resident_kb()
+            start = time.time()
+            try:
+                call(*args)
+            finally:
+                times.append(time.time() - start)
+                gc.enable()
+            grown = max(grown, resident_kb() - start_kb)
+        times.sort()
+        result = {
+            'min_ms': round(1000 * times[0], 3),
+            'p50_ms': round(1000 * percentile(times, 0.5), 3),
+            'p90_ms': round(1000 * percentile(times, 0.9), 3),
+            'p99_ms': round(1000 * percentile(times, 0.99), 3),
+            'max_ms': round(1000 * times[-1], 3),
+            'grown_kb': grown,
+        }
+        self.results[name] = result
+        print '%-40s %9.3f %9.3f %9.3f %9.3f %9.3f %9d' % (name, result['min_ms'], result['p50_ms'],
+              result['p90_ms'], result['p99_ms'], result['max_ms'], grown)
+        sys.stdout.flush()
+
+    def run_all(self):
+        print '%-40s %9s %9s %9s %9s %9s %9s' % ('benchmark (ms per call)', 'min', 'p50', 'p90',
+                                             'p99', 'max', 'grown kb')
+        for state_name in sorted(self.states):
+            state = self.states[state_name]
+            for engine in self.engines:
+                self.run_phases(state_name, state, engine)
+            for bot in BOTS:
+                self.run_bot(state_name, state, bot)
+            self.run_look_ahead(state_name, state)
+
+    def run_phases(self, state_name, state, engine):
+        maps = {}
+        def fresh_map():
+            # Keep one map per state and engine and just reload the guys onto
+            # it, except for the sparse turn data which depends on history
+            if engine not in maps:
+                maps[engine] = game.make_map(engine, state['seed'])
+            m = maps[engine]
+            load_state(m, state)
+            return m
+        p1_orders = some_orders(state['p1g'], 1)
+        p2_orders = some_orders(state['p2g'], 2)
+        p1_records = [(x, y, direction, n) for ((x, y), direction), n in p1_orders.iteritems()]
+        p2_records = [(x, y, direction, n) for ((x, y), direction), n in p2_orders.iteritems()]
+
+        def sparse_setup():
+            m = game.make_map(engine, state['seed'])
+            load_state(m, state)
+            return m, SPARSE
+        calls = {
+            'turn_data_dense': (lambda: (fresh_map(), DENSE),
+                                lambda m, style: m.turn_data_for_p1(style)),
+            'turn_data_sparse': (sparse_setup, lambda m, style: m.turn_data_for_p1(style)),
+            'turn_data_arrays': (lambda: (fresh_map(), ARRAYS),
+                                 lambda m, style: m.turn_data_for_p1(style)),
+            'apply_moves': (lambda: (fresh_map(),),
+                            lambda m: m.apply_moves(p1_orders, p2_orders)),
+            'apply_moves_records': (lambda: (fresh_map(),),
+                                    lambda m: m.apply_moves(p1_records, p2_records)),
+            'resolve_combat': (lambda: (fresh_map(),), lambda m: m.resolve_combat()),
+            'give_payouts': (lambda: (fresh_map(),), lambda m: m.give_payouts()),
+            'spawn_new_guys': (lambda: (fresh_map(),), lambda m: m.spawn_new_guys()),
+            'board_state_for_json': (lambda: (fresh_map(),),
+                                     lambda m: m.board_state_for_json()),
+        }
+        for phase in PHASES:
+            setup, call = calls[phase]
+            self.run('%s/%s.%s' % (state_name, engine, phase), setup, call)
+
+    def run_bot(self, state_name, state, bot):
+        Player = importlib.import_module(bot).Player
+        m = Map(seed=state['seed'])
+        load_state(m, state)
+        style = getattr(Player, 'TURN_DATA', DENSE)
+
+        def setup():
+            random.seed(0)
+            player = Player(*m.constructor_data_for_p1(getattr(Player, 'MAP_ANALYSIS', False)))
+            # Sparse turn data comes from a new map each time, so the bot
+            # sees every occupied cell as changed, like a first turn
+            fresh = Map(seed=state['seed'])
+            load_state(fresh, state)
+            return player, fresh.turn_data_for_p1(style)
+        self.run('%s/bot.%s' % (state_name, bot), setup,
+                 lambda player, turn_data: player.take_turn(*turn_data))
+
+    def run_look_ahead(self, state_name, state):
+        """ A turn played and taken back on the board a bot sees, made from
+        constructor data with the map's analysis on the end like
+        phoglenix3 gets """
+        m = Map(seed=state['seed'])
+        load_state(m, state)
+        constructor_data = m.constructor_data_for_p1(analysis=True)
+        turn_data = m.turn_data_for_p1()
+        p1_orders = some_orders(state['p1g'], 1)
+        p2_orders = some_orders(state['p2g'], 2)
+
+        def look_ahead():
+            board = Map.from_guys(constructor_data, *turn_data)
+            board.play_turn(p1_orders, p2_orders)
+            board.undo_turn()
+        self.run('%s/look_ahead' % state_name, lambda: (), look_ahead)
+
+
+def calibrate(runs=7, loops=20):
+    """ Milliseconds for the median of runs goes of a fixed bit of Python
+    (a few tens of milliseconds each), to tell how fast the machine is going
+    right now """
+    times = []
+    for i in range(runs):
+        gc.collect()
+        gc.disable()
+        start = time.time()
+        for loop in range(loops):
+            grid = [[0] * 50 for x in range(50)]
+            counts = {}
+            for x in range(50):
+                for y in range(50):
+                    grid[x][y] = x * y % 7
+                    counts[x, y % 5] = counts.get((x, y % 5), 0) + grid[x][y]
+        times.append(time.time() - start)
+        gc.enable()
+    times.sort()
+    return round(1000 * percentile(times, 0.5), 4)
+
+
+def compare(results, baseline, tolerance, calibration):
+    """ Descriptions of the benchmarks that got worse, each against its
+    baseline scaled by how many times longer the calibration loop takes now
+    (calibration ms) than when that baseline was saved """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline or 'calibration_ms' not in baseline[name]:
+            continue
+        now, before = results[name], baseline[name]
+        speed = calibration / before['calibration_ms']
+        expected = before['p50_ms'] * speed
+        noise = max(NOISE_MS, now['p90_ms'] - now['p50_ms'],
+                    (before['p90_ms'] - before['p50_ms']) * speed)
+        if now['p50_ms'] > expected * tolerance and now['p50_ms'] - expected > noise:
+            regressions.append('%s: median %.3fms, expected %.3fms (%.3fms in the baseline)'
+                               % (name, now['p50_ms'], expected, before['p50_ms']))
+        if now['grown_kb'] > before['grown_kb'] * tolerance and \
+           now['grown_kb'] - before['grown_kb'] > NOISE_KB:
+            regressions.append('%s: grew %dKB, was %dKB' % (name, now['grown_kb'],
+                                                            before['grown_kb']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the engine and bots.')
+    parser.add_argument('--repeat', type=int, default=10, help='calls per benchmark')
+    parser.add_argument('--only', metavar='TEXT', help='only benchmarks with TEXT in the name')
+    parser.add_argument('--engine', action='append', choices=['list', 'numpy'],
+                        help='engine(s) to benchmark; default both, if NumPy is installed')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='how many times slower than the baseline is a regression')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save the results as the new baseline instead of comparing')
+    parser.add_argument('--record-states', action='store_true',
+                        help='play a game to record %s again, then stop' % STATES_PATH)
+    args = parser.parse_args()
+
+    game.PRINT_TRACE = False
+    if args.record_states:
+        record_states(STATES_PATH)
+        sys.exit(0)
+
+    engines = args.engine
+    if not engines:
+        engines = ['list']
+        try:
+            import numpy
+            engines.append('numpy')
+        except ImportError:
+            pass
+
+    with open(STATES_PATH) as f:
+        states = json.load(f)
+    states['crowded'] = crowded_state()
+
+    start_calibration = calibrate()
+    benchmarks = Benchmarks(states, engines, args.repeat, args.only)
+    benchmarks.run_all()
+    # Check again at the end in case the machine slowed down part way through
+    end_calibration = calibrate()
+    calibration = round((start_calibration + end_calibration) / 2, 4)
+    if abs(end_calibration - start_calibration) > CALIBRATION_DRIFT * calibration:
+        print
+        print 'WARNING: the calibration loop took %.1fms before the benchmarks and %.1fms ' \
+              'after, so the machine\'s speed changed during the run' % (start_calibration,
+                                                                      end_calibration)
+
+    if args.save_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except IOError:
+            baseline = {}
+        # The baselines of benchmarks that weren't run this time are kept as
+        # they are, with the calibration they were measured with
+        for result in benchmarks.results.values():
+            result['calibration_ms'] = calibration
+        baseline.update(benchmarks.results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print 'Saved %d baselines to %s' % (len(benchmarks.results), args.baseline)
+        sys.exit(0)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except IOError:
+        print 'No baseline in %s to compare with; save one with --save-baseline' % args.baseline
+        sys.exit(0)
+
+    compared = [baseline[name] for name in benchmarks.results if name in baseline]
+    untagged = [before for before in compared if 'calibration_ms' not in before]
+    speeds = sorted(before['calibration_ms'] / calibration
+                    for before in compared if 'calibration_ms' in before)
+    print
+    if untagged:
+        print '%d baselines have no calibration (saved by an older bench.py) and were ' \
+              'skipped; save them again' % len(untagged)
+    if speeds and speeds[0] == speeds[-1]:
+        print 'The machine is running %.2f times as fast as for the baseline' % speeds[0]
+    elif speeds:
+        print 'The machine is running %.2f to %.2f times as fast as for the baselines' \
+              % (speeds[0], speeds[-1])
+    regressions = compare(benchmarks.results, baseline, args.tolerance, calibration)
+    if regressions:
+        print
+        print '%d REGRESSIONS against %s:' % (len(regressions), args.baseline)
+        for regression in regressions:
+            print '    ' + regression
+        sys.exit(1)
+    print
+    print 'No regressions against %s' % args.baseline
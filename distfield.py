@@ -0,0 +1,143 @@
+""" A distance field over the board that is kept between turns and only
+repaired where it changed, for the phoglenix bots.
+
+Each cell has a seed value (or none) and a cost of moving into it.  The
+distance of a cell is the smallest of its seed value, LIMIT, and the distance
+of a neighbour plus the cell's cost - exactly what the bots' Dijkstra from all
+seeds at once used to compute from scratch every turn.
+
+update() takes the new seeds and costs and repairs the field in the style of
+Ramalingam and Reps' dynamic shortest paths: cells whose distance may have
+gone up (because the seed or cost they relied on got worse, or the neighbour
+they came through did) are reset and recomputed from their neighbours, cells
+that may have gone down are pushed on the heap, and Dijkstra runs from just
+those cells.  Cells nothing changed for are not touched. """
+import heapq
+
+import actions
+from topology import topology_for, OFF_BOARD
+
+LIMIT = 999
+
+
+class DistanceField:
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        size = width * height
+        self.seeds = [None] * size
+        self.costs = [None] * size
+        self.dist = [LIMIT] * size
+        # The neighbour each cell's distance came through, or -1 if it is the
+        # cell's own seed (or LIMIT)
+        self.parent = [-1] * size
+        # The cells next to each cell, right, left, up then down
+        step = topology_for(width, height).step
+        steps = [step[actions.RIGHT], step[actions.LEFT], step[actions.UP], step[actions.DOWN]]
+        self.neighbours = [[s[i] for s in steps if s[i] != OFF_BOARD] for i in xrange(size)]
+
+    def update(self, seeds, costs):
+        """ Bring the field up to date.  seeds and costs are flat lists in
+        x-major order (cell x, y at x * height + y); a seed of None means the
+        cell isn't a seed. """
+        dist, parent, neighbours = self.dist, self.parent, self.neighbours
+        old_seeds, old_costs = self.seeds, self.costs
+        self.seeds, self.costs = seeds, costs
+
+        changed = []
+        raised = []
+        for i in xrange(len(seeds)):
+            seed, cost = seeds[i], costs[i]
+            old_seed, old_cost = old_seeds[i], old_costs[i]
+            if seed == old_seed and cost == old_cost:
+                continue
+            changed.append(i)
+            if parent[i] == -1:
+                if dist[i] != LIMIT and (seed is None or seed > old_seed):
+                    raised.append(i)
+            elif old_cost is None or cost > old_cost:
+                raised.append(i)
+
+        # Everything whose distance came through a raised cell may be raised too
+        affected = set(raised)
+        stack = raised
+        while stack:
+            i = stack.pop()
+            for j in neighbours[i]:
+                if parent[j] == i and j not in affected:
+                    affected.add(j)
+                    stack.append(j)
+        for i in affected:
+            seed = seeds[i]
+            dist[i] = LIMIT if seed is None or seed > LIMIT else seed
+            parent[i] = -1
+
+        # Recompute the suspect cells from their neighbours and start Dijkstra
+        # from every cell that got better
+        open = []
+        for i in affected.union(changed):
+            seed = seeds[i]
+            best = LIMIT if seed is None or seed > LIMIT else seed
+            best_parent = -1
+            cost = costs[i]
+            for j in neighbours[i]:
+                d = dist[j] + cost
+                if d < best:
+                    best = d
+                    best_parent = j
+            if i in affected or best < dist[i]:
+                dist[i] = best
+                parent[i] = best_parent
+                open.append((best, i))
+
+        heapq.heapify(open)
+        while open:
+            d, i = heapq.heappop(open)
+            if dist[i] < d:
+                continue # Shorter dist found already
+            for j in neighbours[i]:
+                d2 = d + costs[j]
+                if dist[j] > d2:
+                    dist[j] = d2
+                    parent[j] = i
+                    heapq.heappush(open, (d2, j))
+
+    def grid(self):
+        """ A copy of the distances as a [x][y] grid, free to be changed """
+        h = self.height
+        return [self.dist[x * h:(x + 1) * h] for x in range(self.width)]
+
+
+def split_stack(count, choices, step):
+    """ Share count chickens out between choices, a list of (dist, food)
+    pairs, the way sending them one at a time to the lowest dist (higher food
+    breaking ties, then the earlier choice) and raising that dist by step
+    after each one would.  This is water filling: the lowest dists are filled
+    up to a common level.  Returns how many chickens each choice gets.  With
+    a step of 0 (or less) the dists never go up, so they all go to the
+    best choice. """
+    ranked = sorted(range(len(choices)),
+                    key=lambda i: (choices[i][0], -choices[i][1], i))
+    if step <= 0:
+        shares = [0] * len(choices)
+        shares[ranked[0]] = count
+        return shares
+    # Find how many of the lowest choices the water reaches, and its level
+    total = count * step
+    for filled in range(1, len(ranked) + 1):
+        total += choices[ranked[filled - 1]][0]
+        level = total / filled
+        if filled == len(ranked) or level <= choices[ranked[filled]][0]:
+            break
+
+    shares = [0] * len(choices)
+    fractions = []
+    for rank in range(filled):
+        i = ranked[rank]
+        share = max(0.0, (level - choices[i][0]) / step)
+        shares[i] = int(share)
+        fractions.append((-(share - int(share)), rank, i))
+    # Whole chickens left over go to the choices closest to getting another
+    fractions.sort()
+    for unused, rank, i in fractions[:count - sum(shares)]:
+        shares[i] += 1
+    return shares
@@ -1,6 +1,9 @@
 import actions
 
 class Player:
+    # Ask for the guys on the board as a list of occupied spots as well as the
+    # usual grid (explained in take_turn below)
+    TURN_DATA = 'sparse'
 
     #Get passed all the board information that never changes throughout the game.
     #It is recommended that you store these in member variables since you will probably need to look at them later.
@@ -30,6 +33,18 @@ class Player:
     #       An entry of 'None' indicates an unoccupied spot.
     #       A space with chickens will be an object with "num_guys" and "is_mine" properties.
     #
+    #       Because this bot sets TURN_DATA = 'sparse' (at the top), guys also has:
+    #         guys.occupied: a list of (x, y, population) for just the occupied spots,
+    #           so you don't have to look through all 2500 of them.
+    #         guys.changed: a list of (x, y, population) for the spots that changed
+    #           since last turn.  population is None if the spot is now empty.
+    #         guys.my_income, guys.their_income: the (money, food) each player's
+    #           spots will bring in at the end of this turn.
+    #       Set TURN_DATA = 'arrays' instead (needs NumPy) and guys has guys.mine,
+    #         guys.theirs and guys.money_payout_rates: read-only 50x50 NumPy arrays
+    #         of each player's guys on every spot and of the payout rates, for
+    #         working on the whole board at once.  Copy them to keep them.
+    #       Leave TURN_DATA out and guys is a plain 2D list.
 
     #   my_food:
     #       A float showing how much food you have left over from last turn.
@@ -46,24 +61,21 @@ class Player:
     # RETURN:
     #   a python dict that takes a tuple ((x_pos, y_pos), direction) as a key and the number of guys to move as the value.
     #   direction is defined in action.py
+    #
+    #   Or, as this bot does, a list of (x_pos, y_pos, quantities) where quantities is a list of how
+    #   many guys to move in each direction (quantities[actions.UP] move up, and so on).  A list of
+    #   (x_pos, y_pos, direction, quantity) works too.  See orders.py for the details.
 
     def take_turn(self, guys, my_food, their_food, my_money, their_money):
-        width = len(guys)
-        height = len(guys[0])
-
-        orders ={}
-        for x in range(width):
-            for y in range(height):
-                if not guys[x][y]: continue
-
-                num_guys, is_mine = guys[x][y]
-                if not is_mine: continue
-
-                for i in range(num_guys):
-                    key = ((x, y), actions.ALL_ACTIONS[i % len(actions.ALL_ACTIONS)])
-                    if key not in orders:
-                        orders[key] = 1
-                    else:
-                        orders[key] += 1
+        orders = []
+        for x, y, (num_guys, is_mine) in guys.occupied:
+            if not is_mine: continue
+
+            # Share the guys out between the directions, one at a time in the
+            # order of ALL_ACTIONS
+            quantities = [0] * len(actions.ALL_ACTIONS)
+            for i, direction in enumerate(actions.ALL_ACTIONS):
+                quantities[direction] = (num_guys - i + len(actions.ALL_ACTIONS) - 1) / len(actions.ALL_ACTIONS)
+            orders.append((x, y, quantities))
 
         return orders
@@ -1,90 +1,304 @@
 import sys
 import json
+import argparse
+import importlib
+import random
+import threading
 import re
 import httplib, urllib
+from collections import namedtuple
 from traceback import print_exc
 from functools import partial
 
 from networkplayer import NetworkPlayer
 
-from map import Map
+from map import Map, DENSE
 import actions
+import replay
+from profiler import TurnProfiler
 
 NUM_TURNS = 1000
 STARTING_MONEY = 100
 
 PRINT_TRACE = True
 
-if len(sys.argv) != 3:
-    print "Usage: %s player1_module player2_module" % sys.argv[0]
-    sys.exit(1)
+GameResult = namedtuple('GameResult', ['p1_money', 'p2_money', 'p1_crashed', 'p2_crashed'])
 
 
-if sys.argv[1].endswith(".py"):
-    exec('from %s import Player as Player1' % sys.argv[1][:-3])
-else:
-    Player1 = partial(NetworkPlayer, sys.argv[1])
+def load_player(name, turn_deadline=None):
+    """ The Player class of a bot module (mybot.py), or a NetworkPlayer
+    factory if name is the port of a networked bot.  A NetworkPlayer waits
+    turn_deadline seconds for each turn, or its own default if it's None. """
+    if name.endswith(".py"):
+        return importlib.import_module(name[:-3]).Player
+    if turn_deadline is not None:
+        return partial(NetworkPlayer, name, turn_deadline=turn_deadline)
+    return partial(NetworkPlayer, name)
 
 
-if sys.argv[2].endswith(".py"):
-    exec('from %s import Player as Player2' % sys.argv[2][:-3])
-else:
-    Player2 = partial(NetworkPlayer, sys.argv[2])
+def make_player(name, m, player_no, params=None, turn_deadline=None):
+    """ The bot name (a module or port) as player 1 or 2 on map m.  params
+    are keyword arguments for its Player; turn_deadline is passed on to
+    load_player. """
+    Player = load_player(name, turn_deadline)
+    analysis = getattr(Player, 'MAP_ANALYSIS', False)
+    if player_no == 1:
+        constructor_data = m.constructor_data_for_p1(analysis)
+    else:
+        constructor_data = m.constructor_data_for_p2(analysis)
+    return Player(*constructor_data, **(params or {}))
 
 
-m = Map()
-p1_crashed = False
-p2_crashed = False
-p1 = Player1(*m.constructor_data_for_p1())
-p2 = Player2(*m.constructor_data_for_p2())
+def make_process_player(name, m, player_no, params=None, turn_deadline=None):
+    """ A bot module run in a worker process as player 1 or 2 on map m, or
+    a NetworkPlayer for a port, which has nothing to gain from one """
+    if name.endswith(".py"):
+        from procplayer import ProcessPlayer
+        return ProcessPlayer(name[:-3], m, player_no, params)
+    return make_player(name, m, player_no, params, turn_deadline)
 
 
-json_data = {'p1_spawn': m.p1_spawn, 'p2_spawn': m.p2_spawn,
-     'money_payout_rates': m.money_payout_rates, 'turns': [m.board_state_for_json()]}
+def make_map(engine='list', seed=None, map_cache=None, size=None, num_hills=4,
+             hill_size=None, tiles=None):
+    """ A new map.  size is (width, height), 50x50 if it isn't given, and
+    hill_size defaults to 30 on a 50x50 board, in proportion on others.
+    Boards over Map.SPARSE_ABOVE cells are sparse with the list engine.
+    tiles is the number of workers for the tiled engine. """
+    width, height = size or (Map.WIDTH, Map.HEIGHT)
+    if hill_size is None:
+        hill_size = 30 * max(width, height) // 50
+    if engine == 'tiled':
+        from tiledmap import TiledMap
+        return TiledMap(num_hills, hill_size, seed, map_cache, width, height, tiles)
+    if engine == 'numpy':
+        from numpymap import NumpyMap
+        return NumpyMap(num_hills, hill_size, seed, map_cache, width, height)
+    return Map(num_hills, hill_size, seed, map_cache, width, height)
 
-for i in range(NUM_TURNS):
-    print 'Turn #%d' % i
 
-    # Get the players' actions
-    try:
-        p1_actions = [] if p1_crashed else p1.take_turn(*m.turn_data_for_p1())
-    except:
-        if PRINT_TRACE: print_exc()
-        p1_crashed = True
+def board_size(text):
+    """ (width, height) from a board size given as WIDTHxHEIGHT, or as
+    just one number for a square board """
+    match = re.match(r'^(\d+)(?:x(\d+))?$', text)
+    if not match or int(match.group(1)) < 2 or int(match.group(2) or 2) < 2:
+        raise argparse.ArgumentTypeError('%r is not a board size like 500x500' % text)
+    width = int(match.group(1))
+    return width, int(match.group(2) or width)
+
+
+def take_turn(player, turn_data, profiler, phase):
+    """ The player's orders for a turn, or None if it crashed.  The time
+    taken goes to the phase of the same name in the profiler. """
+    with profiler.phase(phase):
+        try:
+            return player.take_turn(*turn_data)
+        except:
+            if PRINT_TRACE: print_exc()
+            return None
+
+
+class BackgroundTurn(threading.Thread):
+    """ Takes a player's turn in another thread; result() waits for the orders """
+    def __init__(self, player, turn_data, profiler, phase):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.player = player
+        self.turn_data = turn_data
+        self.profiler = profiler
+        self.phase = phase
+        self.start()
+
+    def run(self):
+        self.orders = take_turn(self.player, self.turn_data, self.profiler, self.phase)
+
+    def result(self):
+        self.join()
+        return self.orders
+
+
+def play_game(player1, player2, engine='list', seed=None, map_cache=None,
+              log_path=None, verbose=False, profile_path=None, turn_deadline=None,
+              processes=False, size=None, num_hills=4, hill_size=None, tiles=None,
+              p1_params=None, p2_params=None):
+    """ Play one full game between two bots (module names or ports, as on the
+    command line) and return a GameResult.  If seed is given the map is
+    generated from it and the global random module is seeded with it too, so
+    random bots are repeatable as well.  Maps are cached in map_cache.
+    Per-turn timings are written to the CSV profile_path if it's given.
+    If processes is set, bot modules each run in their own worker process
+    and take their turns at the same time, with their own random module
+    (see procplayer.py).  size, num_hills, hill_size and
+    tiles are passed on to make_map.  p1_params and p2_params are keyword
+    arguments for the bots' Player classes, for bots with settings to try. """
+    if seed is not None:
+        random.seed(seed)
+    map_seed = seed
+    if map_seed is None and log_path and replay.is_orders_log(log_path):
+        # An orders log only has the seed to make the map again from.  Pick
+        # one without touching the random module the bots may be using.
+        map_seed = random.SystemRandom().randrange(2**31)
 
+    m = make_map(engine, map_seed, map_cache, size, num_hills, hill_size, tiles)
+    if processes:
+        p1 = make_process_player(player1, m, 1, p1_params, turn_deadline)
+        p2 = make_process_player(player2, m, 2, p2_params, turn_deadline)
+    else:
+        p1 = make_player(player1, m, 1, p1_params, turn_deadline)
+        p2 = make_player(player2, m, 2, p2_params, turn_deadline)
+
+    log = None
+    if log_path:
+        # Each turn is written to the game log as it's played, for visualization later
+        log = replay.open_writer(log_path, m)
+
+    profiler = TurnProfiler(profile_path)
     try:
-        p2_actions = [] if p2_crashed else p2.take_turn(*m.turn_data_for_p2())
-    except:
-        if PRINT_TRACE: print_exc()
-        p2_crashed = True
+        return run_game(m, p1, p2, log, verbose, concurrent=processes,
+                        profiler=profiler, turn_deadline=turn_deadline)
+    finally:
+        if log:
+            log.close()
+        for p in (p1, p2, m):
+            if hasattr(p, 'close'):
+                p.close()
+        profiler.close()
+        if verbose and profile_path:
+            profiler.print_summary()
+
+
+def run_game(m, p1, p2, log=None, verbose=False, concurrent=False,
+             profiler=None, turn_deadline=None):
+    """ Play all the turns of a game on map m between two Player objects and
+    return a GameResult.  If concurrent is set both players take their turn
+    at the same time, player 2 in another thread, which saves waiting when
+    they are networked bots.
+
+    Each bot's turn and each phase of the engine is timed with profiler (a
+    TurnProfiler, or a new one without memory readings), and its summary is
+    added to the end of the log.  A turn that takes a bot longer than
+    turn_deadline seconds is played with no orders, like a crash, but the bot
+    gets its next turn as usual. """
+    if profiler is None:
+        profiler = TurnProfiler(memory=False)
+    p1_crashed = False
+    p2_crashed = False
+    p1_style = getattr(p1, 'TURN_DATA', DENSE)
+    p2_style = getattr(p2, 'TURN_DATA', DENSE)
+    if log:
+        log.write_turn(m.board_state_for_json())
+
+    for i in range(NUM_TURNS):
+        if verbose: print 'Turn #%d' % i
+
+        # Get the players' actions
+        if concurrent and not p2_crashed:
+            with profiler.phase('turn_data'):
+                p2_data = m.turn_data_for_p2(p2_style)
+            p2_turn = BackgroundTurn(p2, p2_data, profiler, 'p2_turn')
+        p1_actions = None
+        if not p1_crashed:
+            with profiler.phase('turn_data'):
+                p1_data = m.turn_data_for_p1(p1_style)
+            p1_actions = take_turn(p1, p1_data, profiler, 'p1_turn')
+        if concurrent and not p2_crashed:
+            p2_actions = p2_turn.result()
+        else:
+            p2_actions = None
+            if not p2_crashed:
+                with profiler.phase('turn_data'):
+                    p2_data = m.turn_data_for_p2(p2_style)
+                p2_actions = take_turn(p2, p2_data, profiler, 'p2_turn')
+
+        if p1_actions is None:
+            p1_crashed = True
+            p1_actions = []
+        if p2_actions is None:
+            p2_crashed = True
+            p2_actions = []
+
+        if turn_deadline is not None:
+            if profiler.elapsed('p1_turn') > turn_deadline:
+                if verbose: print 'Player 1 went over the turn deadline'
+                profiler.overrun('p1_turn')
+                p1_actions = []
+            if profiler.elapsed('p2_turn') > turn_deadline:
+                if verbose: print 'Player 2 went over the turn deadline'
+                profiler.overrun('p2_turn')
+                p2_actions = []
 
-    m.apply_moves(p1_actions, p2_actions)
-    m.resolve_combat()
+        if log:
+            with profiler.phase('log'):
+                log.write_orders(p1_actions, p2_actions)
+        with profiler.phase('apply_moves'):
+            m.apply_moves(p1_actions, p2_actions)
+        with profiler.phase('resolve_combat'):
+            m.resolve_combat()
 
-    m.give_payouts()
-    m.spawn_new_guys()
+        with profiler.phase('give_payouts'):
+            m.give_payouts()
+        with profiler.phase('spawn_new_guys'):
+            m.spawn_new_guys()
 
-    m.resolve_combat() #in case the new guys spawned into combat
+        with profiler.phase('resolve_combat'):
+            m.resolve_combat() #in case the new guys spawned into combat
 
-    json_data['turns'].append(m.board_state_for_json())
+        if log:
+            with profiler.phase('log'):
+                log.write_turn(m.board_state_for_json())
+        profiler.end_turn()
 
+    if log:
+        log.write_profile(profiler.summary())
 
-print '---- FINAL SCORE ----'
-print '%s:\t%f' % (sys.argv[1], m.p1_money)
-print '%s:\t%f' % (sys.argv[2], m.p2_money)
-print
+    return GameResult(m.p1_money, m.p2_money, p1_crashed, p2_crashed)
 
-winner = sys.argv[1]
-if m.p1_money > m.p2_money:
-    print 'WINNER: %s' % sys.argv[1]
-elif m.p1_money < m.p2_money:
-    print 'WINNER: %s' % sys.argv[2]
-else:
-    print 'TIED!'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a game between two bots.')
+    parser.add_argument('player1', help='bot module (mybot.py) or port of a networked bot')
+    parser.add_argument('player2', help='bot module (mybot.py) or port of a networked bot')
+    parser.add_argument('--engine', choices=['list', 'numpy', 'tiled'], default='list',
+                        help='board implementation; numpy needs NumPy installed, and '
+                             'tiled splits each turn over several cores')
+    parser.add_argument('--tiles', type=int,
+                        help='worker processes for the tiled engine (default one per core)')
+    parser.add_argument('--seed', type=int, help='map seed, for a repeatable game')
+    parser.add_argument('--map-cache', metavar='DIR', help='directory of cached maps')
+    parser.add_argument('--size', type=board_size, metavar='WIDTHxHEIGHT',
+                        help='board size (default 50x50); boards over %d cells keep '
+                             'only the occupied cells' % Map.SPARSE_ABOVE)
+    parser.add_argument('--hills', type=int, default=4,
+                        help='number of money hills, each mirrored for fairness')
+    parser.add_argument('--hill-size', type=int,
+                        help='largest hill spread in cells (default 30 on 50x50, '
+                             'in proportion on other sizes)')
+    parser.add_argument('--log', default='game_log.js',
+                        help='game log to write: game_log.js for viz.html, a compact '
+                             '.jsonl or .jsonl.gz log, or a .orders.jsonl[.gz] log of '
+                             'just the orders (convert them with replay.py); '
+                             'an empty name writes no log')
+    parser.add_argument('--profile', metavar='CSV',
+                        help='write the time taken by each bot and engine phase every '
+                             'turn to a CSV, and print a summary at the end')
+    parser.add_argument('--processes', action='store_true',
+                        help='run each bot in its own process, both thinking at once')
+    parser.add_argument('--turn-deadline', type=float, metavar='SECONDS',
+                        help='play a bot\'s turn with no orders if it takes longer')
+    args = parser.parse_args()
 
-# Save the game log to disk for visualization later
-json_str = json.dumps(json_data)
-with open('game_log.js', 'w') as f:
-    f.write("window.game = %s" % json_str)
+    result = play_game(args.player1, args.player2, engine=args.engine, seed=args.seed,
+                       map_cache=args.map_cache, log_path=args.log, verbose=True,
+                       profile_path=args.profile, turn_deadline=args.turn_deadline,
+                       processes=args.processes, size=args.size, num_hills=args.hills,
+                       hill_size=args.hill_size, tiles=args.tiles)
 
+    print '---- FINAL SCORE ----'
+    print '%s:\t%f' % (args.player1, result.p1_money)
+    print '%s:\t%f' % (args.player2, result.p2_money)
+    print
 
+    if result.p1_money > result.p2_money:
+        print 'WINNER: %s' % args.player1
+    elif result.p1_money < result.p2_money:
+        print 'WINNER: %s' % args.player2
+    else:
+        print 'TIED!'
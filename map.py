@@ -3,10 +3,31 @@ import math
 import random
 import copy
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from collections import namedtuple
 Population = namedtuple('Population', ['num_guys', 'is_mine'])
+# Money and food a player's cells bring in each turn
+Income = namedtuple('Income', ['money', 'food'])
+
+# Ways of passing the guys on the board to take_turn.  A Player class picks one
+# by setting TURN_DATA, and gets DENSE if it doesn't.  SHARED passes None, for
+# players that read the board some other way (see procplayer.py).  ARRAYS
+# passes a BoardArrays and needs NumPy.
+DENSE = 'dense'
+SPARSE = 'sparse'
+SHARED = 'shared'
+ARRAYS = 'arrays'
 
 import actions
+import orders
+import mapcache
+import mapanalysis
+from topology import topology_for
+from sparseboard import SparseGrid, SparseTable, CellTable, LazyPayouts
 
 class Gaussian2D:
     """ http://en.wikipedia.org/wiki/Gaussian_function """
@@ -26,6 +47,123 @@ class Gaussian2D:
                               (2 * self.b * (x - self.cx) * (y - self.cy)) +
                               (self.c * (y - self.cy)**2)))
 
+    @staticmethod
+    def sum_over_grid(hills, width, height, x0=0):
+        """ Sum of the hills at every point of a width x height grid, as a
+        numpy array indexed [x][y].  All hills are evaluated in one go.  x0
+        moves the grid right, to sum part of a wider board. """
+        xs, ys = numpy.mgrid[x0:x0 + width, 0:height]
+        params = numpy.array([(h.cx, h.cy, h.a, h.b, h.c) for h in hills])
+        cx, cy, a, b, c = [p.reshape(-1, 1, 1) for p in params.T]
+        dx = xs - cx
+        dy = ys - cy
+        values = numpy.exp(-1 * ((a * dx**2) + (2 * b * dx * dy) + (c * dy**2)))
+        total = values[0]
+        for v in values[1:]:
+            total = total + v
+        return total
+
+
+class SparseGuys:
+    """ The guys argument of take_turn for a bot with TURN_DATA = 'sparse'.
+
+    occupied is a list of (x, y, Population) for every occupied cell, and
+    changed lists (x, y, Population or None) for every cell that is different
+    from the last turn this bot was sent.  my_income and their_income are the
+    Income each player's cells bring in per turn.  Indexing it like the usual
+    2D grid (guys[x][y]) still works; the grid is only built the first time
+    it's used, and can be changed by the bot like the usual one. """
+    def __init__(self, width, height, occupied, changed, my_income=None, their_income=None):
+        self.width, self.height = width, height
+        self.occupied = occupied
+        self.changed = changed
+        self.my_income = my_income
+        self.their_income = their_income
+        self.__grid = None
+
+    def grid(self):
+        if self.__grid is None:
+            self.__grid = [[None] * self.height for x in range(self.width)]
+            for x, y, population in self.occupied:
+                self.__grid[x][y] = population
+        return self.__grid
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        return self.grid()[x]
+
+    def __iter__(self):
+        return iter(self.grid())
+
+
+class BoardArrays:
+    """ The guys argument of take_turn for a bot with TURN_DATA = 'arrays'.
+
+    mine and theirs are width x height NumPy arrays of how many guys each
+    player has on every cell, and money_payout_rates the same of the payout
+    rates, all read only.  On the numpy and tiled engines they are views of
+    the engine's own arrays, so nothing is copied each turn, but they change
+    as the game goes on: copy anything that has to last past the turn.
+    my_income and their_income are as for SparseGuys, and guys[x][y] still
+    gives the usual grid, built the first time it's used. """
+    def __init__(self, mine, theirs, money_payout_rates, my_income=None, their_income=None):
+        self.width, self.height = mine.shape
+        self.mine = mine
+        self.theirs = theirs
+        self.money_payout_rates = money_payout_rates
+        self.my_income = my_income
+        self.their_income = their_income
+        self.__grid = None
+
+    def grid(self):
+        if self.__grid is None:
+            self.__grid = [[None] * self.height for x in range(self.width)]
+            for guys, is_mine in ((self.theirs, False), (self.mine, True)):
+                xs, ys = numpy.nonzero(guys)
+                for x, y, num_guys in zip(xs.tolist(), ys.tolist(), guys[xs, ys].tolist()):
+                    self.__grid[x][y] = Population(num_guys, is_mine)
+        return self.__grid
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        return self.grid()[x]
+
+    def __iter__(self):
+        return iter(self.grid())
+
+
+def read_only(array):
+    """ A view of array that can't be written through """
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def make_guys(width, height, occupied, style, last_seen, incomes=(None, None)):
+    """ The guys argument of take_turn in the given style, from a list of
+    (x, y, Population) for every occupied cell in x-major order.  last_seen
+    is a dict of the cells the bot was sent last turn, and is brought up to
+    date for working out which cells changed.  incomes is the bot's and the
+    other player's Income, for sparse turn data. """
+    if style == SPARSE:
+        current = dict(((x, y), population) for x, y, population in occupied)
+        changed = [(x, y, population) for x, y, population in occupied
+                   if last_seen.get((x, y)) != population]
+        changed += [(x, y, None) for (x, y) in last_seen if (x, y) not in current]
+        changed.sort()
+        last_seen.clear()
+        last_seen.update(current)
+        return SparseGuys(width, height, occupied, changed, *incomes)
+
+    guys = [[None] * height for x in range(width)]
+    for x, y, population in occupied:
+        guys[x][y] = population
+    return guys
+
 
 class Map:
     """ A class that represents the relevant features of a game board """
@@ -33,28 +171,271 @@ class Map:
     HEIGHT = 50
     STARTING_FOOD = 10
     STARTING_MONEY = 0
+    # Boards with more cells than this are sparse unless asked otherwise
+    SPARSE_ABOVE = 256 * 256
 
-    def __init__(self, num_hills=4, hill_size=30):
-        self.width, self.height = Map.WIDTH, Map.HEIGHT
-        self.money_payout_rates = self.__generate_payouts(num_hills, hill_size)
-        self.p1_guys = [[0] * self.height for x in range(self.width)]
-        self.p2_guys = [[0] * self.height for x in range(self.width)]
+    def __init__(self, num_hills=4, hill_size=30, seed=None, cache_dir=None,
+                 width=WIDTH, height=HEIGHT, sparse=None, layout=None):
+        """ The same seed and parameters always give the same map.  If
+        cache_dir is given, generated maps are saved there and loaded back
+        instead of being generated again.  layout is an optional
+        (money_payout_rates, p1_spawn, p2_spawn) to use instead of
+        generating them, like the constructor data bots are given.
+
+        A sparse map keeps only the occupied cells (see sparseboard.py) and
+        works out the payout rates of a part of the board the first time
+        they're needed, so it can be far bigger than the usual 50x50.  It
+        plays exactly the same game, and isn't cached. """
+        self.width, self.height = width, height
+        if sparse is None:
+            sparse = width * height > Map.SPARSE_ABOVE
+        self.sparse = sparse
+        self.seed = seed
+        self.num_hills, self.hill_size = num_hills, hill_size
+        self.random = random.Random(seed)
+        cached = None
+        if cache_dir is not None and seed is not None and not sparse:
+            path = mapcache.path_for(cache_dir, seed, self.width, self.height,
+                                     num_hills, hill_size)
+            cached = mapcache.load(path)
+        if layout is not None:
+            self.money_payout_rates, self.p1_spawn, self.p2_spawn = layout
+        elif cached:
+            self.money_payout_rates, (self.p1_spawn, self.p2_spawn) = cached
+        else:
+            self.money_payout_rates = self.__generate_payouts(num_hills, hill_size)
+            self.p1_spawn, self.p2_spawn = self.__generate_spawn_points()
+            if cache_dir is not None and seed is not None and not sparse:
+                mapcache.save(path, self.money_payout_rates, (self.p1_spawn, self.p2_spawn))
+        self.p1_guys = self.__new_grid()
+        self.p2_guys = self.__new_grid()
+        # Every cell each player has guys on, as x * height + y (which sorts
+        # much faster than (x, y)), so each phase of a turn only has to look
+        # at those
+        self.p1_cells = set()
+        self.p2_cells = set()
+        # The cell numbers and neighbour tables of a board this size (see
+        # topology.py), shared with every other board of the same size.  Too
+        # big to make for a sparse board, which has None.
+        if sparse:
+            self.topology = None
+            self.__positions = CellTable(self.height, lambda x, y: (x, y))
+        else:
+            self.topology = topology_for(width, height)
+            self.__positions = self.topology.positions
+        self.__occupied = None # occupied_cells(), until the board changes
+        # Who owns each cell (0 for nobody, or 1 or 2) and what the owned
+        # cells bring in, kept up to date as cells change hands so payouts
+        # don't have to add up the board.  Money is counted in thousandths,
+        # which the rates are whole numbers of, so the totals are exact.
+        rates = self.money_payout_rates
+        if sparse:
+            self.__milli_rates = CellTable(self.height,
+                                           lambda x, y: int(round(1000 * rates[x][y])))
+        else:
+            self.__milli_rates = [int(round(1000 * rates[x][y])) for x, y in self.__positions]
+        self.__owner = self.__new_table()
+        self.__milli_income = [0, 0, 0]
+        self.__num_owned = [0, 0, 0]
         self.p1_food = Map.STARTING_FOOD
         self.p2_food = Map.STARTING_FOOD
         self.p1_money = Map.STARTING_MONEY
         self.p2_money = Map.STARTING_MONEY
-        self.p1_spawn, self.p2_spawn = self.__generate_spawn_points()
+        # What each player was last sent as sparse turn data, for the deltas
+        self.__last_seen = {}
+        # What each play_turn() changed, for undo_turn()
+        self.__undo = []
+        self.__analysis = None
+        self.__payout_array = None
+
+    @staticmethod
+    def from_guys(constructor_data, guys, my_food=STARTING_FOOD, their_food=STARTING_FOOD,
+                  my_money=STARTING_MONEY, their_money=STARTING_MONEY):
+        """ The board a bot sees, as a Map with the bot as player 1, from the
+        constructor data its Player was made with and the arguments of
+        take_turn.  guys can be the usual grid of Populations or sparse turn
+        data.  Bots can look ahead on it with play_turn(), undo_turn() and
+        clone().  A MapAnalysis on the end of the constructor data (see
+        mapanalysis.py) becomes the map's analysis(). """
+        money_payout_rates = constructor_data[0]
+        m = Map(width=len(money_payout_rates), height=len(money_payout_rates[0]),
+                layout=constructor_data[:3])
+        if len(constructor_data) > 3:
+            m.__analysis = constructor_data[3]
+        p1_guys = m.__new_grid()
+        p2_guys = m.__new_grid()
+        if hasattr(guys, 'occupied'):
+            occupied = guys.occupied
+        else:
+            occupied = [(x, y, population) for x, column in enumerate(guys)
+                        for y, population in enumerate(column) if population]
+        for x, y, (num_guys, is_mine) in occupied:
+            if is_mine:
+                p1_guys[x][y] = num_guys
+            else:
+                p2_guys[x][y] = num_guys
+        m.set_guys(p1_guys, p2_guys)
+        m.p1_food, m.p2_food = my_food, their_food
+        m.p1_money, m.p2_money = my_money, their_money
+        return m
+
+    def clone(self):
+        """ A copy of the map to play on without changing this one.  The
+        payout rates and the other tables that never change are shared. """
+        m = copy.copy(self)
+        m.p1_guys = self.__new_grid(self.p1_guys)
+        m.p2_guys = self.__new_grid(self.p2_guys)
+        m.p1_cells = set(self.p1_cells)
+        m.p2_cells = set(self.p2_cells)
+        if self.sparse:
+            m.__owner = SparseTable(self.__owner)
+        else:
+            m.__owner = list(self.__owner)
+        m.__milli_income = list(self.__milli_income)
+        m.__num_owned = list(self.__num_owned)
+        m.__last_seen = {}
+        m.__undo = []
+        return m
+
+    def play_turn(self, p1_actions, p2_actions):
+        """ Play a whole turn from both players' orders, the way game.run_game
+        does, remembering what it changed so undo_turn() can take it back.
+        Both only touch the cells that change. """
+        before = (self.p1_food, self.p2_food, self.p1_money, self.p2_money)
+        p1_moves = orders.accepted_moves(p1_actions, self.p1_guys, self.width, self.height)
+        p2_moves = orders.accepted_moves(p2_actions, self.p2_guys, self.width, self.height)
+        self.make_moves(p1_moves, p2_moves)
+        fights = self.__fight()
+        self.give_payouts()
+        spawned = self.__spawn()
+        fights += self.__fight()
+        self.__undo.append((before, p1_moves, p2_moves, fights, spawned))
+
+    def undo_turn(self):
+        """ Put the board back how it was before the last play_turn() """
+        before, p1_moves, p2_moves, fights, spawned = self.__undo.pop()
+        self.p1_food, self.p2_food, self.p1_money, self.p2_money = before
+        # Every step only adds to or takes from cells, so they can be taken
+        # back in any order
+        height = self.height
+        changed = set()
+        self.__move(self.p1_guys, [(x2, y2, x, y, n) for x, y, x2, y2, n in p1_moves], changed)
+        self.__move(self.p2_guys, [(x2, y2, x, y, n) for x, y, x2, y2, n in p2_moves], changed)
+        for x, y, num_dead in fights:
+            self.p1_guys[x][y] += num_dead
+            self.p2_guys[x][y] += num_dead
+            changed.add(x * height + y)
+        p1_spawned, p2_spawned = spawned
+        (x, y), (x2, y2) = self.p1_spawn, self.p2_spawn
+        self.p1_guys[x][y] -= p1_spawned
+        self.p2_guys[x2][y2] -= p2_spawned
+        changed.add(x * height + y)
+        changed.add(x2 * height + y2)
+        self.__update_cells(changed)
+
+    def set_guys(self, p1_guys, p2_guys):
+        """ Put guys on the board: p1_guys and p2_guys are [x][y] grids of
+        how many guys each player has in each cell """
+        self.p1_guys = self.__new_grid(p1_guys)
+        self.p2_guys = self.__new_grid(p2_guys)
+        self.p1_cells = set()
+        self.p2_cells = set()
+        self.__owner = self.__new_table()
+        self.__milli_income = [0, 0, 0]
+        self.__num_owned = [0, 0, 0]
+        self.__undo = []
+        if self.sparse:
+            cells = set(self.p1_guys.cells()) | set(self.p2_guys.cells())
+        else:
+            cells = [(x, y) for x, y in self.__positions
+                     if self.p1_guys[x][y] or self.p2_guys[x][y]]
+        self.__update_cells([x * self.height + y for x, y in cells])
+
+    def __new_grid(self, rows=None):
+        """ An [x][y] grid of guys, empty or copied from rows """
+        if self.sparse:
+            return SparseGrid(self.width, self.height, rows)
+        if rows is None:
+            return [[0] * self.height for x in range(self.width)]
+        return [list(row) for row in rows]
+
+    def __new_table(self):
+        """ A flat table of 0 for every cell """
+        if self.sparse:
+            return SparseTable()
+        return [0] * (self.width * self.height)
+
+    def __update_cells(self, changed):
+        """ Bring the sets of cells, the owners and the incomes up to date
+        after the guys on the given cells (as x * height + y) changed """
+        positions = self.__positions
+        owner = self.__owner
+        p1_grid, p2_grid = self.p1_guys, self.p2_guys
+        p1_cells, p2_cells = self.p1_cells, self.p2_cells
+        for i in changed:
+            x, y = positions[i]
+            p2_guys = p2_grid[x][y]
+            if p1_grid[x][y]:
+                new_owner = 1
+            elif p2_guys:
+                new_owner = 2
+            else:
+                new_owner = 0
+            old_owner = owner[i]
+            if new_owner == old_owner:
+                # The owner says whether p1 is on the cell, and whether p2 is
+                # unless p1 is, so only p2's set can be out of date
+                if new_owner == 1:
+                    if p2_guys:
+                        p2_cells.add(i)
+                    else:
+                        p2_cells.discard(i)
+                continue
+            if new_owner == 1:
+                p1_cells.add(i)
+            elif old_owner == 1:
+                p1_cells.discard(i)
+            if p2_guys:
+                p2_cells.add(i)
+            else:
+                p2_cells.discard(i)
+            self.__milli_income[old_owner] -= self.__milli_rates[i]
+            self.__num_owned[old_owner] -= 1
+            self.__milli_income[new_owner] += self.__milli_rates[i]
+            self.__num_owned[new_owner] += 1
+            owner[i] = new_owner
+        self.__occupied = None
+
+    def income_for_p1(self):
+        """ The Income player 1's cells bring in each turn """
+        return self.__income_of(1)
+
+    def income_for_p2(self):
+        return self.__income_of(2)
+
+    def __income_of(self, player):
+        milli_money = self.__milli_income[player]
+        return Income(milli_money / 1000.0,
+                      (1000 * self.__num_owned[player] - milli_money) / 1000.0)
+
+    def __sorted_cells(self):
+        """ (x, y) of every occupied cell, in x-major order """
+        positions = self.__positions
+        return [positions[i] for i in sorted(self.p1_cells | self.p2_cells)]
 
     def board_state_for_json(self):
         p1_guys_json = []
         p2_guys_json = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.p1_guys[x][y] > 0:
-                    p1_guys_json.append([x, y, self.p1_guys[x][y]])
-                elif self.p2_guys[x][y] > 0:
-                    p2_guys_json.append([x, y, self.p2_guys[x][y]])
+        for x, y, num_guys, p1_owns in self.occupied_cells():
+            if num_guys > 0:
+                if p1_owns:
+                    p1_guys_json.append([x, y, num_guys])
+                else:
+                    p2_guys_json.append([x, y, num_guys])
+            elif self.p2_guys[x][y] > 0:
+                p2_guys_json.append([x, y, self.p2_guys[x][y]])
         return {'p1m': self.p1_money, 'p2m': self.p2_money,
+                'p1i': list(self.income_for_p1()), 'p2i': list(self.income_for_p2()),
                 'p1g': p1_guys_json, 'p2g': p2_guys_json}
 
     def __compute_spawn_amount(self, food):
@@ -66,113 +447,182 @@ class Map:
         return cost, num_guys
 
     def spawn_new_guys(self):
+        self.__spawn()
+
+    def __spawn(self):
+        """ spawn_new_guys, returning how many guys each player got """
+        p1_spawned = p2_spawned = 0
         cost, guys_to_spawn = self.__compute_spawn_amount(self.p1_food)
         if guys_to_spawn > 0:
             p1_spawn_x, p1_spawn_y = self.p1_spawn
             current = self.p1_guys[p1_spawn_x][p1_spawn_y]
             self.p1_guys[p1_spawn_x][p1_spawn_y] = int(current) + int(guys_to_spawn)
+            self.__update_cells([p1_spawn_x * self.height + p1_spawn_y])
             self.p1_food -= cost
+            p1_spawned = int(guys_to_spawn)
 
         cost, guys_to_spawn = self.__compute_spawn_amount(self.p2_food)
         if guys_to_spawn > 0:
             p2_spawn_x, p2_spawn_y = self.p2_spawn
             current = self.p2_guys[p2_spawn_x][p2_spawn_y]
             self.p2_guys[p2_spawn_x][p2_spawn_y] = int(current) + int(guys_to_spawn)
+            self.__update_cells([p2_spawn_x * self.height + p2_spawn_y])
             self.p2_food -= cost
+            p2_spawned = int(guys_to_spawn)
+        return p1_spawned, p2_spawned
 
     def give_payouts(self):
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.p1_guys[x][y]:
-                    self.p1_money += self.money_payout_rates[x][y]
-                    self.p1_food += (1.0 - self.money_payout_rates[x][y])
-                elif self.p2_guys[x][y]:
-                    self.p2_money += self.money_payout_rates[x][y]
-                    self.p2_food += (1.0 - self.money_payout_rates[x][y])
+        if self.__num_owned[1]:
+            income = self.income_for_p1()
+            self.p1_money += income.money
+            self.p1_food += income.food
+        if self.__num_owned[2]:
+            income = self.income_for_p2()
+            self.p2_money += income.money
+            self.p2_food += income.food
 
     def apply_moves(self, p1_actions, p2_actions):
-        new_p1_guys = [[0] * self.height for x in range(self.width)]
-        new_p2_guys = [[0] * self.height for x in range(self.width)]
-        for (x, y), direction in p1_actions:
-            quantity = int(p1_actions[((x, y), direction)])
-            if direction not in actions.ALL_ACTIONS: continue
-            if self.p1_guys[x][y] >= quantity:
-                new_x, new_y = actions.next_pos((x, y), direction)
-                if self.__is_on_board((new_x, new_y)):
-                    new_p1_guys[new_x][new_y] += quantity
-                    self.p1_guys[x][y] -= quantity
-        for (x, y), direction in p2_actions:
-            quantity = int(p2_actions[((x, y), direction)])
-            if direction not in actions.ALL_ACTIONS: continue
-            if self.p2_guys[x][y] >= quantity:
-                new_x, new_y = actions.next_pos((x, y), direction)
-                if self.__is_on_board((new_x, new_y)):
-                    new_p2_guys[new_x][new_y] += quantity
-                    self.p2_guys[x][y] -= quantity
-        for x in range(self.width):
-            for y in range(self.height):
-                new_p1_guys[x][y] += self.p1_guys[x][y]
-                new_p2_guys[x][y] += self.p2_guys[x][y]
-        self.p1_guys = new_p1_guys
-        self.p2_guys = new_p2_guys
+        """ Move both players' guys.  The orders can be in any of the formats
+        in orders.py. """
+        p1_moves = orders.accepted_moves(p1_actions, self.p1_guys, self.width, self.height)
+        p2_moves = orders.accepted_moves(p2_actions, self.p2_guys, self.width, self.height)
+        self.make_moves(p1_moves, p2_moves)
+
+    def make_moves(self, p1_moves, p2_moves):
+        """ Move both players' guys by moves that have already been checked,
+        as (x, y, new_x, new_y, quantity) like orders.accepted_moves gives """
+        changed = set()
+        self.__move(self.p1_guys, p1_moves, changed)
+        self.__move(self.p2_guys, p2_moves, changed)
+        self.__update_cells(changed)
+
+    def __move(self, guys, moves, changed):
+        """ Make a player's accepted moves, adding the cells they changed (as
+        x * height + y) to the set changed """
+        height = self.height
+        add = changed.add
+        for x, y, new_x, new_y, quantity in moves:
+            guys[x][y] -= quantity
+            guys[new_x][new_y] += quantity
+            add(x * height + y)
+            add(new_x * height + new_y)
 
     def resolve_combat(self):
-        for x in range(self.width):
-            for y in range(self.height):
-                num_dead = min(self.p1_guys[x][y], self.p2_guys[x][y])
+        self.__fight()
+
+    def __fight(self):
+        """ resolve_combat, returning (x, y, num_dead) for every cell fought
+        over """
+        # Only occupied cells can have a fight.  (Looking at all of them, not
+        # just those both players are on, also catches the negative numbers
+        # of guys a bad order can leave.)
+        fought = []
+        cells = []
+        for i in self.p1_cells | self.p2_cells:
+            x, y = self.__positions[i]
+            num_dead = min(self.p1_guys[x][y], self.p2_guys[x][y])
+            if num_dead:
                 if num_dead < 0:
                     print num_dead
                 self.p1_guys[x][y] -= num_dead
                 self.p2_guys[x][y] -= num_dead
+                fought.append((x, y, num_dead))
+                cells.append(i)
+        if cells:
+            self.__update_cells(cells)
+        return fought
 
-    def __is_on_board(self, position):
-        x, y = position
-        if x < 0 or x >= self.width: return False
-        if y < 0 or y >= self.height: return False
-        return True
+    def constructor_data_for_p1(self, analysis=False):
+        """ The arguments of player 1's Player, with the map's MapAnalysis
+        on the end if analysis is set (see mapanalysis.py) """
+        data = (self.money_payout_rates, self.p1_spawn, self.p2_spawn)
+        if analysis:
+            data += (self.analysis(),)
+        return data
 
-    def constructor_data_for_p1(self):
-        return (self.money_payout_rates, self.p1_spawn, self.p2_spawn)
+    def constructor_data_for_p2(self, analysis=False):
+        data = (self.money_payout_rates, self.p2_spawn, self.p1_spawn)
+        if analysis:
+            data += (self.analysis(),)
+        return data
 
-    def constructor_data_for_p2(self):
-        return (self.money_payout_rates, self.p2_spawn, self.p1_spawn)
+    def analysis(self):
+        """ The MapAnalysis of the map, made the first time it's asked for
+        (or shared with other maps of the same seed) """
+        if self.__analysis is None:
+            self.__analysis = mapanalysis.analysis_for(self)
+        return self.__analysis
 
-    def turn_data_for_p1(self):
-        guys = [[None] * self.height for x in range(self.width)]
-        for x in range(self.width):
-            for y in range(self.height):
+    def occupied_cells(self):
+        """ (x, y, num_guys, p1_owns) for every occupied cell, in x-major
+        order.  The list is kept until the board changes, so don't change it. """
+        if self.__occupied is None:
+            cells = []
+            for x, y in self.__sorted_cells():
                 if self.p1_guys[x][y]:
-                    guys[x][y] = Population(self.p1_guys[x][y], True)
-                elif self.p2_guys[x][y]:
-                    guys[x][y] = Population(self.p2_guys[x][y], False)
+                    cells.append((x, y, self.p1_guys[x][y], True))
+                else:
+                    cells.append((x, y, self.p2_guys[x][y], False))
+            self.__occupied = cells
+        return self.__occupied
+
+    def turn_data_for_p1(self, style=DENSE):
+        guys = self.__guys_for(1, style)
         return (guys, self.p1_food, self.p2_food, self.p1_money, self.p2_money)
 
-    def turn_data_for_p2(self):
-        guys = [[None] * self.height for x in range(self.width)]
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.p1_guys[x][y]:
-                    guys[x][y] = Population(self.p1_guys[x][y], False)
-                elif self.p2_guys[x][y]:
-                    guys[x][y] = Population(self.p2_guys[x][y], True)
+    def turn_data_for_p2(self, style=DENSE):
+        guys = self.__guys_for(2, style)
         return (guys, self.p2_food, self.p1_food, self.p2_money, self.p1_money)
 
+    def __guys_for(self, player, style):
+        """ The guys argument of take_turn for player 1 or 2 """
+        if style == SHARED:
+            return None
+        is_p1 = player == 1
+        incomes = (self.income_for_p1(), self.income_for_p2())
+        if not is_p1:
+            incomes = incomes[::-1]
+        if style == ARRAYS:
+            p1_guys, p2_guys, rates = self.board_arrays()
+            if not is_p1:
+                p1_guys, p2_guys = p2_guys, p1_guys
+            return BoardArrays(read_only(p1_guys), read_only(p2_guys), read_only(rates), *incomes)
+        occupied = [(x, y, Population(num_guys, p1_owns == is_p1))
+                    for x, y, num_guys, p1_owns in self.occupied_cells()]
+        last_seen = self.__last_seen.setdefault(player, {})
+        return make_guys(self.width, self.height, occupied, style, last_seen, incomes)
+
+    def board_arrays(self):
+        """ (p1 guys, p2 guys, money payout rates) as width x height NumPy
+        arrays, for ARRAYS turn data.  A Map keeps lists, so the guys are
+        copied into new arrays every time; the engines that keep arrays hand
+        out their own. """
+        if numpy is None:
+            raise ImportError('arrays turn data needs NumPy')
+        if self.sparse:
+            raise ValueError('arrays turn data needs a board that isn\'t sparse')
+        if self.__payout_array is None:
+            self.__payout_array = numpy.array(self.money_payout_rates, dtype=numpy.float64)
+        return (numpy.array(self.p1_guys, dtype=numpy.int64),
+                numpy.array(self.p2_guys, dtype=numpy.int64), self.__payout_array)
+
     def __mirror(self, x, y):
         """ Mirror a point over the diagonal of the map """
         return (self.width - x - 1, self.height - y - 1)
 
     def __generate_payouts(self, num_hills, hill_size):
         """ Compute several gaussians and build the payout map """
-        hills = []
-        for i in range(num_hills):
-            cx = random.randint(0, self.width - 1)
-            cy = random.randint(0, self.height - 1)
-            sx = random.random() * hill_size + 1
-            sy = random.random() * hill_size + 1
-            theta = random.random() * math.pi
-            hills.append(Gaussian2D((cx, cy), (sx, sy), theta))
-            # Add a mirror image one too to make the map fair
-            hills.append(Gaussian2D(self.__mirror(cx, cy), (sx, sy), theta + math.pi))
+        hills = self.__generate_hills(num_hills, hill_size)
+        if self.sparse:
+            return LazyPayouts(lambda x0, x1: self.__hill_columns(hills, x0, x1),
+                               self.width, self.height)
+
+        if numpy is not None:
+            # Sum all the hills and normalize the rates from 0->1
+            total = Gaussian2D.sum_over_grid(hills, self.width, self.height)
+            offset = total - total.min()
+            rates = offset / (total.max() - total.min())
+            return ((1000 * rates).astype(int) / 1000.0).tolist()
 
         # Sum all the hills
         money_payout_rates = [[0.0] * self.height for x in range(self.width)]
@@ -191,11 +641,31 @@ class Map:
 
         return money_payout_rates
 
+    def __hill_columns(self, hills, x0, x1):
+        """ The summed hills of columns x0 to x1 - 1, not yet normalized """
+        if numpy is not None:
+            return Gaussian2D.sum_over_grid(hills, x1 - x0, self.height, x0).tolist()
+        return [[sum([h.value((x, y)) for h in hills]) for y in range(self.height)]
+                for x in range(x0, x1)]
+
+    def __generate_hills(self, num_hills, hill_size):
+        hills = []
+        for i in range(num_hills):
+            cx = self.random.randint(0, self.width - 1)
+            cy = self.random.randint(0, self.height - 1)
+            sx = self.random.random() * hill_size + 1
+            sy = self.random.random() * hill_size + 1
+            theta = self.random.random() * math.pi
+            hills.append(Gaussian2D((cx, cy), (sx, sy), theta))
+            # Add a mirror image one too to make the map fair
+            hills.append(Gaussian2D(self.__mirror(cx, cy), (sx, sy), theta + math.pi))
+        return hills
+
     def __generate_spawn_points(self):
         """ Keep trying random points until it's mirror is far enough away """
         while True:
-            p1x = random.randint(0, self.width - 1)
-            p1y = random.randint(0, self.height - 1)
+            p1x = self.random.randint(0, self.width - 1)
+            p1y = self.random.randint(0, self.height - 1)
             p2x, p2y = self.__mirror(p1x, p1y)
             d_sq = (p1x - p2x)**2 + (p1y - p2y)**2
             if d_sq >= (self.width / 2)**2:
@@ -203,6 +673,9 @@ class Map:
         return (p1x, p1y), (p2x, p2y)
 
     def to_struct(self):
+        rates = self.money_payout_rates
+        if self.sparse:
+            rates = [list(column) for column in rates]
         return {'p1_spawn': self.p1_spawn,
                 'p2_spawn': self.p2_spawn,
-                'money_payout_rates': self.money_payout_rates}
+                'money_payout_rates': rates}
@@ -0,0 +1,114 @@
+""" Things about a map that never change during a game, worked out once so
+bots don't have to work them out again every turn.
+
+A bot whose Player class sets MAP_ANALYSIS = True is given a MapAnalysis as
+a fourth constructor argument, after their_spawn_point.  The same one is
+shared by both bots and every game on the same map, so it is made of
+tuples and must not be changed.
+
+    food            [x][y] food payout rates, 1.0 - money_payout_rates[x][y]
+    neighbours      [x][y] tuple of (direction, x2, y2) for each move off
+                    (x, y) that stays on the board, in the order of
+                    actions.ALL_ACTIONS[1:] (topology.py's grid_neighbours)
+    spawn_distance  {spawn point: [x][y] moves from it}, for both spawns
+    money_peaks     (x, y) of the tops of the money hills, best first
+    region          [x][y] number of the region each cell is in: the board
+                    split into connected areas that are better for money
+                    (rate >= 0.5) or for food
+    regions         (is_money, number of cells, mean money rate) of each
+                    region, by region number
+
+Making one goes through every cell a few times, so only bots that ask for
+it get one. """
+from topology import topology_for
+
+# How many analyses analysis_for keeps, most recently used first
+CACHE_SIZE = 32
+
+_cache = []
+
+
+class MapAnalysis:
+    """ The analysis of a map, from the constructor data of either player """
+    def __init__(self, money_payout_rates, p1_spawn, p2_spawn):
+        width, height = len(money_payout_rates), len(money_payout_rates[0])
+        self.width, self.height = width, height
+        self.money = tuple(tuple(column) for column in money_payout_rates)
+        self.food = tuple(tuple(1.0 - rate for rate in column) for column in self.money)
+
+        self.neighbours = topology_for(width, height).grid_neighbours
+
+        # Nothing blocks a move, so the distance is just the moves along and up
+        self.spawn_distance = {}
+        for sx, sy in (tuple(p1_spawn), tuple(p2_spawn)):
+            self.spawn_distance[sx, sy] = tuple(
+                tuple(abs(x - sx) + abs(y - sy) for y in range(height)) for x in range(width))
+
+        self.money_peaks = self.__peaks()
+        self.region, self.regions = self.__regions()
+
+    def __peaks(self):
+        """ Cells at least as good for money as all eight around them, best
+        first, leaving out any next to a better one already picked (the
+        other cells of a flat top) """
+        money = self.money
+        tops = []
+        for x in range(self.width):
+            for y in range(self.height):
+                rate = money[x][y]
+                if all(money[x2][y2] <= rate for x2, y2 in self.__around(x, y)):
+                    tops.append((-rate, x, y))
+        tops.sort()
+        peaks = []
+        for unused, x, y in tops:
+            if not any(abs(x - px) <= 1 and abs(y - py) <= 1 for px, py in peaks):
+                peaks.append((x, y))
+        return tuple(peaks)
+
+    def __around(self, x, y):
+        return [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                if (dx or dy) and 0 <= x + dx < self.width and 0 <= y + dy < self.height]
+
+    def __regions(self):
+        """ The region grid and the list of regions """
+        region = [[None] * self.height for x in range(self.width)]
+        regions = []
+        for x in range(self.width):
+            for y in range(self.height):
+                if region[x][y] is not None:
+                    continue
+                is_money = self.money[x][y] >= 0.5
+                number = len(regions)
+                region[x][y] = number
+                open_cells = [(x, y)]
+                size = 0
+                total = 0.0
+                while open_cells:
+                    cx, cy = open_cells.pop()
+                    size += 1
+                    total += self.money[cx][cy]
+                    for direction, x2, y2 in self.neighbours[cx][cy]:
+                        if region[x2][y2] is None and (self.money[x2][y2] >= 0.5) == is_money:
+                            region[x2][y2] = number
+                            open_cells.append((x2, y2))
+                regions.append((is_money, size, total / size))
+        return tuple(tuple(column) for column in region), tuple(regions)
+
+
+def analysis_for(m):
+    """ The MapAnalysis of map m.  Maps made from a seed share one per seed
+    and parameters (the last CACHE_SIZE of them are kept), so a worker
+    playing many games on the same seeds only makes each one once. """
+    key = None
+    if m.seed is not None:
+        key = (m.seed, m.width, m.height, m.num_hills, m.hill_size,
+               tuple(m.p1_spawn), tuple(m.p2_spawn))
+        for i, (cached_key, analysis) in enumerate(_cache):
+            if cached_key == key:
+                _cache.insert(0, _cache.pop(i))
+                return analysis
+    analysis = MapAnalysis(m.money_payout_rates, m.p1_spawn, m.p2_spawn)
+    if key is not None:
+        _cache.insert(0, (key, analysis))
+        del _cache[CACHE_SIZE:]
+    return analysis
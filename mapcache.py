@@ -0,0 +1,64 @@
+""" On-disk cache of generated maps, so a batch of games can replay exactly
+the same boards without generating them again.
+
+Each map is a small file named after its seed and generation parameters.
+Payout rates are always a whole number of thousandths, so they are stored as
+16 bit integers and zlib compressed; a 50x50 map takes a few kilobytes. """
+import os
+import sys
+import zlib
+import array
+import struct
+import tempfile
+
+MAGIC = 'CAMAP1'
+HEADER = struct.Struct('<6sHHHHHH')
+
+
+def path_for(cache_dir, seed, width, height, num_hills, hill_size):
+    name = '%dx%d-h%d-s%s-%d.map' % (width, height, num_hills, hill_size, seed)
+    return os.path.join(cache_dir, name)
+
+
+def save(path, money_payout_rates, spawn_points):
+    """ Write a map to path.  The file is written under a temporary name and
+    renamed into place, so processes sharing a cache never see half a map. """
+    (p1x, p1y), (p2x, p2y) = spawn_points
+    width, height = len(money_payout_rates), len(money_payout_rates[0])
+    rates = array.array('H', [int(round(rate * 1000))
+                              for column in money_payout_rates for rate in column])
+    if sys.byteorder != 'little':
+        rates.byteswap()
+    data = HEADER.pack(MAGIC, width, height, p1x, p1y, p2x, p2y)
+    data += zlib.compress(rates.tostring(), 9)
+
+    cache_dir = os.path.dirname(path)
+    if cache_dir and not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass # Made by another process in the meantime
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+def load(path):
+    """ Read back (money_payout_rates, spawn_points) as written by save, or
+    None if there is no usable map at path """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        return None
+    magic, width, height, p1x, p1y, p2x, p2y = HEADER.unpack(data[:HEADER.size])
+    rates = array.array('H')
+    rates.fromstring(zlib.decompress(data[HEADER.size:]))
+    if sys.byteorder != 'little':
+        rates.byteswap()
+    money_payout_rates = [[rates[x * height + y] / 1000.0 for y in range(height)]
+                          for x in range(width)]
+    return money_payout_rates, ((p1x, p1y), (p2x, p2y))
@@ -0,0 +1,122 @@
+""" Host many games at once against networked bots.
+
+python matchhost.py 2103 2104 mybot.py --seeds 5 --matches 16 --max-in-flight 4
+
+Plays a round robin between the given bots (ports of networked bots, or bot
+modules) with up to --matches games running at the same time, each in its
+own thread.  In every game both players are asked for their moves at once,
+and all the games share one pool of keep-alive connections, with at most
+--max-in-flight requests waiting on any one port.  Networked bots are told
+which game a request is for in the X-Match-Id header.
+
+Threads rather than processes, because the time goes on waiting for the bots
+to answer, not on running the games. """
+import argparse
+import threading
+import Queue
+from functools import partial
+from itertools import combinations
+from traceback import print_exc
+
+import game
+from map import Map
+from networkplayer import NetworkPlayer, ConnectionPool
+from tournament import Standings
+
+
+class MatchHost:
+    def __init__(self, max_matches, max_in_flight, map_cache=None):
+        self.max_matches = max_matches
+        self.map_cache = map_cache
+        self.pool = ConnectionPool(max_in_flight)
+        self.lock = threading.Lock()
+
+    def player_class(self, name, match_id):
+        if name.endswith(".py"):
+            return game.load_player(name)
+        return partial(NetworkPlayer, name, pool=self.pool, match_id=match_id)
+
+    def make_player(self, name, match_id, m, player_no):
+        """ The bot name as player 1 or 2 on map m, or None if it crashed
+        (or a networked bot didn't answer) while starting up """
+        try:
+            Player = self.player_class(name, match_id)
+            analysis = getattr(Player, 'MAP_ANALYSIS', False)
+            if player_no == 1:
+                return Player(*m.constructor_data_for_p1(analysis))
+            return Player(*m.constructor_data_for_p2(analysis))
+        except Exception:
+            if game.PRINT_TRACE: print_exc()
+            return None
+
+    def play(self, match_id, player1, player2, seed):
+        """ Play one game and return its GameResult.  A bot that crashes
+        starting up loses the game as crashed, with no money for either bot. """
+        m = Map(seed=seed, cache_dir=self.map_cache)
+        p1 = self.make_player(player1, match_id, m, 1)
+        p2 = self.make_player(player2, match_id, m, 2)
+        if p1 is None or p2 is None:
+            return game.GameResult(0.0, 0.0, p1 is None, p2 is None)
+        return game.run_game(m, p1, p2, concurrent=True)
+
+    def run(self, jobs, on_result):
+        """ Play all jobs, (player1, player2, seed) tuples, calling
+        on_result(job, result) as each game finishes """
+        queue = Queue.Queue()
+        for match_id, job in enumerate(jobs):
+            queue.put((match_id, job))
+
+        def worker():
+            while True:
+                try:
+                    match_id, job = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    result = self.play(match_id, *job)
+                except Exception:
+                    # Don't let one broken game stop this worker playing the
+                    # rest: it counts as a crash for both bots
+                    with self.lock:
+                        print 'game %d (%s vs %s, seed %d) broke:' % ((match_id,) + job)
+                        print_exc()
+                    result = game.GameResult(0.0, 0.0, True, True)
+                with self.lock:
+                    on_result(job, result)
+
+        threads = [threading.Thread(target=worker) for i in range(self.max_matches)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            # join with a timeout so Ctrl-C still gets through
+            while t.is_alive():
+                t.join(1)
+        self.pool.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host many games against networked bots.')
+    parser.add_argument('bots', nargs='+', help='ports of networked bots or bot modules')
+    parser.add_argument('--seeds', type=int, default=1, help='games per pair of bots')
+    parser.add_argument('--matches', type=int, default=16, help='games played at once')
+    parser.add_argument('--max-in-flight', type=int, default=4,
+                        help='most requests waiting on one port at a time')
+    parser.add_argument('--map-cache', metavar='DIR', help='directory of cached maps')
+    args = parser.parse_args()
+
+    game.PRINT_TRACE = False
+    jobs = []
+    for bot1, bot2 in combinations(args.bots, 2):
+        for seed in range(args.seeds):
+            jobs.append((bot1, bot2, seed) if seed % 2 == 0 else (bot2, bot1, seed))
+
+    standings = Standings(args.bots)
+    def report(job, result):
+        standings.add(job, result)
+        print '%s vs %s (seed %d): %.1f to %.1f' % (job[0], job[1], job[2],
+                                                     result.p1_money, result.p2_money)
+
+    MatchHost(args.matches, args.max_in_flight, args.map_cache).run(jobs, report)
+    print
+    standings.print_tables()
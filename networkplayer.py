@@ -1,42 +1,190 @@
 import json
+import time
+import socket
+import threading
+from collections import defaultdict
 
 import httplib, urllib
 
+class BotConnection:
+    """ A keep-alive HTTP connection to the bot listening on a port """
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def post(self, path, body, headers, deadline):
+        """ POST body to the bot and return the reply, reusing the connection.
+        If the bot closed the connection since the last request, reconnect
+        and try once more. """
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = httplib.HTTPConnection("127.0.0.1:%s" % self.port)
+            self.conn.timeout = deadline
+            try:
+                self.conn.request("POST", path, body, headers)
+                if self.conn.sock is not None:
+                    self.conn.sock.settimeout(deadline)
+                resp = self.conn.getresponse()
+                return resp.read()
+            except socket.timeout:
+                # Don't leave a late reply on the connection for the next turn
+                self.close()
+                raise
+            except (httplib.BadStatusLine, socket.error):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class ConnectionPool:
+    """ Connections to networked bots shared by many games played at once.
+    Idle connections are reused by whichever game needs one next, and no more
+    than max_in_flight requests are sent to the same port at a time. """
+    def __init__(self, max_in_flight=4):
+        self.max_in_flight = max_in_flight
+        self.lock = threading.Lock()
+        self.idle = defaultdict(list)
+        self.slots = {}
+
+    def post(self, port, path, body, headers, deadline):
+        with self.lock:
+            if port not in self.slots:
+                self.slots[port] = threading.BoundedSemaphore(self.max_in_flight)
+            slots = self.slots[port]
+        with slots:
+            with self.lock:
+                conn = self.idle[port].pop() if self.idle[port] else BotConnection(port)
+            reply = conn.post(path, body, headers, deadline)
+            with self.lock:
+                self.idle[port].append(conn)
+            return reply
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+
 class NetworkPlayer():
+    """ Plays by POSTing the game state to a bot listening on a local port.
+
+    One keep-alive connection is used for the whole game.  The /map request
+    lists the turn payload formats we can send; a bot that replies to it with
+    {"format": <one of them>} gets that format, any other bot gets "form":
+
+        form    the original: url-encoded data=<json> with the 50x50 guys grid
+        json    the same json as the request body, without the url-encoding
+        sparse  a json body whose guys is a list of [x, y, num_guys, is_mine]
+                for just the occupied cells, with my_income and their_income
+                as [money, food] per turn
+
+    Bots reply to each turn with a json list of [x, y, direction, quantity]
+    orders.  Normally the list is turned into the original orders dict, so a
+    later order for the same cell and direction replaces an earlier one.  A
+    bot that also puts "orders": "records" in its /map reply has the list
+    used as it is, as records (see orders.py: repeats are added together),
+    and with "orders": "histogram" it can reply with [x, y, [5 quantities]]
+    for each cell instead.
+
+    A turn that isn't answered within turn_deadline seconds is played with no
+    orders.  A bot that doesn't answer the /map request within
+    MAP_DEADLINE seconds raises socket.timeout instead of hanging the game. """
     headers = {"Content-type": "application/x-www-form-urlencoded",
            "Accept": "text/plain"}
+    json_headers = {"Content-type": "application/json",
+           "Accept": "application/json"}
+    FORMATS = ["form", "json", "sparse"]
+    ORDER_FORMATS = ["records", "histogram"]
+    TURN_DATA = 'sparse'
+    MAP_DEADLINE = 30.0
 
-    def __init__(self, port, money_payout_rates, my_spawn_point, their_spawn_point):
+    def __init__(self, port, money_payout_rates, my_spawn_point, their_spawn_point,
+                 turn_deadline=5.0, pool=None, match_id=None):
+        """ If a ConnectionPool is given, requests go through it instead of
+        this player's own connection.  match_id is sent to the bot in an
+        X-Match-Id header, for bots playing several games at once. """
         print "initing with %s" % port
         self.port = port
-        conn = httplib.HTTPConnection("127.0.0.1:%s" % self.port)
+        self.turn_deadline = turn_deadline
+        self.pool = pool
+        self.match_id = match_id
+        self.conn = BotConnection(port)
+        self.format = "form"
+        self.order_format = None
 
         jsonmap = json.dumps({
-            "money_payout_rates": money_payout_rates,
+            "money_payout_rates": [list(column) for column in money_payout_rates],
             "my_spawn_point": my_spawn_point,
-            "their_spawn_point": their_spawn_point
+            "their_spawn_point": their_spawn_point,
+            "formats": self.FORMATS,
+            "order_formats": self.ORDER_FORMATS
             });
-        conn.request("POST", "/map", urllib.urlencode({'data': jsonmap}), self.headers)
+        reply = self.__post("/map", urllib.urlencode({'data': jsonmap}), self.headers,
+                            self.MAP_DEADLINE)
+        try:
+            chosen = json.loads(reply)
+            if chosen.get("format") in self.FORMATS:
+                self.format = chosen["format"]
+            if chosen.get("orders") in self.ORDER_FORMATS:
+                self.order_format = chosen["orders"]
+        except (ValueError, TypeError, AttributeError):
+            pass # An older bot that doesn't pick a format
 
+    def __post(self, path, body, headers, deadline):
+        if self.match_id is not None:
+            headers = dict(headers, **{"X-Match-Id": str(self.match_id)})
+        if self.pool is not None:
+            return self.pool.post(self.port, path, body, headers, deadline)
+        return self.conn.post(path, body, headers, deadline)
 
+    def close(self):
+        self.conn.close()
 
     def take_turn(self, guys, my_food, their_food, my_money, their_money):
-        conn = httplib.HTTPConnection("127.0.0.1:%s" % self.port)
-
-        jsonmap = json.dumps({
-            "guys": guys,
+        state = {
             "my_food": my_food,
             "their_food": their_food,
             "my_money": my_money,
             "their_money": their_money
-        });
-        conn.request("POST", "/", urllib.urlencode({'data': jsonmap}), self.headers)
-        resp = conn.getresponse()
-        jsonOrders = json.load(resp)
-        orders = {}
-        #This can be cleaned up
+        }
+        if self.format == "sparse":
+            state["guys"] = [[x, y, num_guys, is_mine]
+                             for x, y, (num_guys, is_mine) in guys.occupied]
+            state["my_income"] = guys.my_income
+            state["their_income"] = guys.their_income
+        elif hasattr(guys, "grid"):
+            state["guys"] = guys.grid()
+        else:
+            state["guys"] = guys
+        jsonmap = json.dumps(state, separators=(',', ':'))
+
+        if self.format == "form":
+            body, headers = urllib.urlencode({'data': jsonmap}), self.headers
+        else:
+            body, headers = jsonmap, self.json_headers
+
+        start = time.time()
+        try:
+            reply = self.__post("/", body, headers, self.turn_deadline)
+        except socket.timeout:
+            print "port %s missed the turn deadline" % self.port
+            return {}
+        if self.turn_deadline is not None and time.time() - start > self.turn_deadline:
+            print "port %s missed the turn deadline" % self.port
+            return {}
 
-        for order in jsonOrders:
+        if self.order_format is not None:
+            return json.loads(reply)
+
+        orders = {}
+        for order in json.loads(reply):
             orders[(order[0], order[1]), order[2]] = order[3]
 
         return orders;
@@ -0,0 +1,214 @@
+""" A drop-in replacement for map.Map that keeps the per-cell state in NumPy
+arrays, so each phase of a turn is a few array operations instead of a
+Python loop over every cell.  Results are bit-identical to map.Map. """
+import numpy as np
+
+import actions
+import orders
+from map import Map, Income
+
+
+def order_records(player_orders, width, height):
+    """ Records or a list of histograms as an N x 4 integer array of (x, y,
+    direction, quantity), with the orders orders.py drops left out, or None
+    for orders that aren't integer records or a list of histograms """
+    fmt = orders.order_format(player_orders)
+    if fmt == orders.DICT:
+        return None
+    if fmt == orders.HISTOGRAM:
+        if isinstance(player_orders, np.ndarray):
+            return None
+        player_orders = [(x, y, direction, quantity)
+                         for x, y, quantities in player_orders
+                         for direction, quantity in enumerate(quantities)]
+    records = np.asarray(player_orders)
+    if records.size == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    if records.dtype.kind not in 'iu' or records.ndim != 2 or records.shape[1] != 4:
+        return None
+
+    xs, ys, directions, quantities = records.T
+    keep = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height) & \
+           (directions >= 0) & (directions < len(actions.ALL_ACTIONS)) & (quantities > 0)
+    return records[keep].astype(np.int64)
+
+
+def histogram_array(player_orders, width, height, out=None):
+    """ A width x height x 5 integer array of orders with the negative
+    quantities taken out, or None if player_orders isn't one.  The result
+    goes in out, an int64 array of the same shape, if it's given. """
+    if isinstance(player_orders, np.ndarray) \
+            and player_orders.shape == (width, height, len(actions.ALL_ACTIONS)) \
+            and player_orders.dtype.kind in 'iu':
+        if out is None:
+            return np.maximum(player_orders, 0).astype(np.int64)
+        out[...] = player_orders
+        return np.maximum(out, 0, out=out)
+    return None
+
+
+def moved_guys(guys, requested, first_column=True, last_column=True):
+    """ The guys after the moves of requested, an array of how many guys
+    each cell's orders ask to send each way, are made the orders.py way:
+    nothing goes off the board, and each cell's directions are taken in the
+    order of actions.ALL_ACTIONS while there are enough guys left.
+
+    guys and requested can be a strip of columns of the board; first_column
+    and last_column say whether its ends are the edges of the board.  Guys
+    moving out of the strip are left out, and columns at the ends only get
+    right what moves in from inside the strip. """
+    requested[:, -1, actions.UP] = 0
+    requested[:, 0, actions.DOWN] = 0
+    if last_column:
+        requested[-1, :, actions.RIGHT] = 0
+    if first_column:
+        requested[0, :, actions.LEFT] = 0
+    remaining = guys.copy()
+    for direction in actions.ALL_ACTIONS:
+        moving = requested[:, :, direction]
+        moving[moving > remaining] = 0
+        remaining -= moving
+
+    moved = remaining + requested[:, :, actions.STAY]
+    moved[1:, :] += requested[:-1, :, actions.RIGHT]
+    moved[:-1, :] += requested[1:, :, actions.LEFT]
+    moved[:, 1:] += requested[:, :-1, actions.UP]
+    moved[:, :-1] += requested[:, 1:, actions.DOWN]
+    return moved
+
+
+class NumpyMap(Map):
+    """ map.Map with chicken counts and payout rates stored as arrays """
+
+    def __init__(self, num_hills=4, hill_size=30, seed=None, cache_dir=None,
+                 width=Map.WIDTH, height=Map.HEIGHT, sparse=False):
+        """ sparse only changes how Map keeps its own bookkeeping; the
+        board is always in arrays here """
+        Map.__init__(self, num_hills, hill_size, seed, cache_dir, width, height, sparse)
+        self.payout_array = np.array(self.money_payout_rates, dtype=np.float64)
+        self.milli_array = np.round(1000 * self.payout_array).astype(np.int64)
+        self.p1_guys = np.zeros((self.width, self.height), dtype=np.int64)
+        self.p2_guys = np.zeros((self.width, self.height), dtype=np.int64)
+        self.__undo = []
+
+    def set_guys(self, p1_guys, p2_guys):
+        # Into the arrays we have, so views of them (TURN_DATA = 'arrays')
+        # stay good
+        self.p1_guys[...] = p1_guys
+        self.p2_guys[...] = p2_guys
+        self.__undo = []
+
+    def clone(self):
+        m = Map.clone(self)
+        m.p1_guys = self.p1_guys.copy()
+        m.p2_guys = self.p2_guys.copy()
+        m.__undo = []
+        return m
+
+    def play_turn(self, p1_actions, p2_actions):
+        """ As Map.play_turn, but remembering the board as copies of the two
+        arrays, which are quicker to make here than a list of what changed """
+        self.__undo.append((self.p1_food, self.p2_food, self.p1_money, self.p2_money,
+                            self.p1_guys.copy(), self.p2_guys.copy()))
+        self.apply_moves(p1_actions, p2_actions)
+        self.resolve_combat()
+        self.give_payouts()
+        self.spawn_new_guys()
+        self.resolve_combat()
+
+    def undo_turn(self):
+        (self.p1_food, self.p2_food, self.p1_money, self.p2_money,
+         p1_guys, p2_guys) = self.__undo.pop()
+        self.p1_guys[...] = p1_guys
+        self.p2_guys[...] = p2_guys
+
+    def board_arrays(self):
+        return self.p1_guys, self.p2_guys, self.payout_array
+
+    def board_state_for_json(self):
+        p1_cells = self.p1_guys > 0
+        p2_cells = ~p1_cells & (self.p2_guys > 0)
+        return {'p1m': self.p1_money, 'p2m': self.p2_money,
+                'p1i': list(self.income_for_p1()), 'p2i': list(self.income_for_p2()),
+                'p1g': self.__cell_list(p1_cells, self.p1_guys),
+                'p2g': self.__cell_list(p2_cells, self.p2_guys)}
+
+    def give_payouts(self):
+        p1_owned = self.p1_guys != 0
+        p2_owned = ~p1_owned & (self.p2_guys != 0)
+        if p1_owned.any():
+            income = self.__income(p1_owned)
+            self.p1_money += income.money
+            self.p1_food += income.food
+        if p2_owned.any():
+            income = self.__income(p2_owned)
+            self.p2_money += income.money
+            self.p2_food += income.food
+
+    def income_for_p1(self):
+        return self.__income(self.p1_guys != 0)
+
+    def income_for_p2(self):
+        return self.__income((self.p1_guys == 0) & (self.p2_guys != 0))
+
+    def apply_moves(self, p1_actions, p2_actions):
+        self.__move(self.p1_guys, p1_actions)
+        self.__move(self.p2_guys, p2_actions)
+
+    def resolve_combat(self):
+        num_dead = np.minimum(self.p1_guys, self.p2_guys)
+        for n in num_dead[num_dead < 0]:
+            print n
+        self.p1_guys -= num_dead
+        self.p2_guys -= num_dead
+
+    def occupied_cells(self):
+        p1_owns = self.p1_guys != 0
+        occupied = p1_owns | (self.p2_guys != 0)
+        xs, ys = np.nonzero(occupied)
+        num_guys = np.where(p1_owns, self.p1_guys, self.p2_guys)[occupied]
+        return zip(xs.tolist(), ys.tolist(), num_guys.tolist(), p1_owns[occupied].tolist())
+
+    def __cell_list(self, mask, guys):
+        """ [x, y, num_guys] for every cell in mask, in x-major order """
+        xs, ys = np.nonzero(mask)
+        return [list(cell) for cell in
+                zip(xs.tolist(), ys.tolist(), guys[mask].tolist())]
+
+    def __income(self, owned):
+        """ The Income of the owned cells, worked out in thousandths like
+        Map does so it comes out exactly the same """
+        milli_money = int(self.milli_array[owned].sum())
+        return Income(milli_money / 1000.0,
+                      (1000 * int(owned.sum()) - milli_money) / 1000.0)
+
+    def __move(self, guys, player_orders):
+        """ Make a player's moves on guys.  Records and histograms are
+        checked and made with array operations; dict orders are checked by
+        orders.dict_moves, then scatter-added. """
+        requested = self.__requested(player_orders)
+        if requested is not None:
+            guys[...] = moved_guys(guys, requested)
+            return
+
+        moves = orders.accepted_moves(player_orders, guys.tolist(), self.width, self.height)
+        if moves:
+            xs, ys, new_xs, new_ys, quantities = zip(*moves)
+            flat = guys.reshape(-1)
+            np.subtract.at(flat, np.array(xs) * self.height + ys, quantities)
+            np.add.at(flat, np.array(new_xs) * self.height + new_ys, quantities)
+
+    def __requested(self, player_orders):
+        """ A width x height x 5 array of how many guys each cell's orders
+        ask to send each way, with the orders orders.py drops left out, or
+        None for orders that aren't integer records or histograms """
+        requested = histogram_array(player_orders, self.width, self.height)
+        if requested is not None:
+            return requested
+        records = order_records(player_orders, self.width, self.height)
+        if records is None:
+            return None
+        requested = np.zeros((self.width, self.height, len(actions.ALL_ACTIONS)), dtype=np.int64)
+        xs, ys, directions, quantities = records.T
+        np.add.at(requested, (xs, ys, directions), quantities)
+        return requested
@@ -0,0 +1,129 @@
+""" The ways a bot can give its orders, and which of them go ahead.
+
+take_turn can return its orders in any of these formats:
+
+    dict        {((x, y), direction): quantity}, the original.  The orders
+                are taken in the dict's own order, each going ahead only if
+                there are still at least quantity guys left on its cell.
+
+    records     a list of (x, y, direction, quantity), or an N x 4 integer
+                NumPy array of the same.
+
+    histogram   a list of (x, y, quantities), where quantities has 5 numbers:
+                how many guys to send each way, indexed by direction
+                (quantities[actions.UP] go up), or a width x height x 5
+                integer NumPy array of the same.
+
+Records and histograms are checked a cell at a time:
+
+    - Quantities for the same cell and direction are added together.
+    - Orders for a cell off the board, with a direction that isn't one of
+      actions.ALL_ACTIONS, with a quantity below 1, or that would move guys
+      off the board are dropped.
+    - If a cell's orders add up to more guys than are there, its directions
+      are taken in the order of actions.ALL_ACTIONS (STAY first), each going
+      ahead only if enough guys are left - the dict rule, in a fixed order.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import actions
+
+DICT = 'dict'
+RECORDS = 'records'
+HISTOGRAM = 'histogram'
+
+
+def order_format(orders):
+    """ Which of the formats orders are in """
+    if isinstance(orders, dict):
+        return DICT
+    if numpy is not None and isinstance(orders, numpy.ndarray):
+        return HISTOGRAM if orders.ndim == 3 else RECORDS
+    if len(orders) and len(orders[0]) == 3:
+        return HISTOGRAM
+    return RECORDS
+
+
+def accepted_moves(orders, guys, width, height):
+    """ (x, y, new_x, new_y, quantity) for each of a player's orders that go
+    ahead, in any format, guys being the player's [x][y] grid of guys """
+    if isinstance(orders, dict):
+        return dict_moves(orders, guys, width, height)
+    return cell_moves(cell_orders(orders, width, height), guys, width, height)
+
+
+def dict_moves(orders, guys, width, height):
+    """ accepted_moves for the dict format.  As it always has, a negative x or
+    y counts from the other side of the board (like a list index) for the
+    cell the guys leave, but not for where they go. """
+    moves = []
+    left = {}
+    offsets = actions.OFFSETS
+    for ((x, y), direction), quantity in orders.iteritems():
+        quantity = int(quantity)
+        if direction not in offsets: continue
+        if not (-width <= x < width and -height <= y < height):
+            raise IndexError('order for (%s, %s) is off the board' % (x, y))
+        source = (x % width, y % height)
+        remaining = left.get(source)
+        if remaining is None:
+            remaining = guys[source[0]][source[1]]
+        if remaining >= quantity:
+            x_off, y_off = offsets[direction]
+            new_x, new_y = x + x_off, y + y_off
+            if 0 <= new_x < width and 0 <= new_y < height:
+                moves.append((source[0], source[1], new_x, new_y, quantity))
+                remaining -= quantity
+        left[source] = remaining
+    return moves
+
+
+def cell_orders(orders, width, height):
+    """ {(x, y): [quantity for each direction]} from records or a histogram,
+    without the orders that are dropped """
+    if numpy is not None and isinstance(orders, numpy.ndarray):
+        if orders.ndim == 3:
+            xs, ys = numpy.nonzero((orders > 0).any(axis=2))
+            orders = zip(xs.tolist(), ys.tolist(), orders[xs, ys].tolist())
+        else:
+            orders = orders.tolist()
+
+    cells = {}
+    if order_format(orders) == HISTOGRAM:
+        for x, y, quantities in orders:
+            if not (0 <= x < width and 0 <= y < height): continue
+            for direction in actions.ALL_ACTIONS:
+                quantity = int(quantities[direction])
+                if quantity > 0:
+                    if (x, y) not in cells:
+                        cells[x, y] = [0] * len(actions.ALL_ACTIONS)
+                    cells[x, y][direction] += quantity
+    else:
+        for x, y, direction, quantity in orders:
+            quantity = int(quantity)
+            if quantity < 1 or direction not in actions.OFFSETS: continue
+            if not (0 <= x < width and 0 <= y < height): continue
+            if (x, y) not in cells:
+                cells[x, y] = [0] * len(actions.ALL_ACTIONS)
+            cells[x, y][direction] += quantity
+    return cells
+
+
+def cell_moves(cells, guys, width, height):
+    """ accepted_moves for the orders of cell_orders() """
+    moves = []
+    offsets = actions.OFFSETS
+    for (x, y), quantities in cells.iteritems():
+        remaining = guys[x][y]
+        for direction in actions.ALL_ACTIONS:
+            quantity = quantities[direction]
+            if quantity == 0 or quantity > remaining: continue
+            x_off, y_off = offsets[direction]
+            new_x, new_y = x + x_off, y + y_off
+            if 0 <= new_x < width and 0 <= new_y < height:
+                moves.append((x, y, new_x, new_y, quantity))
+                remaining -= quantity
+    return moves
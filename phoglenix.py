@@ -2,7 +2,8 @@
 # Author: Glen Robertson (phoglenix)
 
 import actions
-import heapq
+from distfield import DistanceField
+from topology import topology_for
 import random
 
 class Player:
@@ -21,20 +22,29 @@ class Player:
 
     #  their_spawn_point:
     #   An (x, y) tuple of where your opponent's chickens will hatch each turn
-    def __init__(self, money_payout_rates, my_spawn_point, their_spawn_point):
+
+    # The magic numbers can be given as keyword arguments too, for tune.py:
+    # crowding is how much each of my guys on a tile puts others off going
+    # through it, and a guy sent to a tile makes it spread_amount less
+    # attractive spread_chance of the time.
+    PARAM_RANGES = {'crowding': (0, None), 'spread_chance': (0, 1),
+                    'spread_amount': (0, None)}
+
+    def __init__(self, money_payout_rates, my_spawn_point, their_spawn_point,
+                 crowding=0.1, spread_chance=0.1, spread_amount=0.1):
         self.money_payout_rates = money_payout_rates
         self.my_spawn_point = my_spawn_point
         self.their_spawn_point = their_spawn_point
         self.width = len(self.money_payout_rates)
         self.height = len(self.money_payout_rates[0])
         self.unoccupied_time = [ [0] * self.height for i in range(self.width) ]
+        self.dist_field = DistanceField(self.width, self.height)
+        # The tiles next to each tile, looked up instead of worked out
+        self.neighbours = topology_for(self.width, self.height).grid_neighbours
+        self.crowding = crowding
+        self.spread_chance = spread_chance
+        self.spread_amount = spread_amount
 
-    def in_bounds(self, x, y):
-        if not 0 <= x < self.width: # bounds
-            return False
-        if not 0 <= y < self.height: # bounds
-            return False
-        return True
     # Gets called each turn and where you decide where your chickens will go
     # PARAMS:
 
@@ -63,7 +73,6 @@ class Player:
     def take_turn(self, guys, my_food, their_food, my_money, their_money):
         width = len(guys)
         height = len(guys[0])
-        MOVE_ACTIONS = actions.ALL_ACTIONS[1:]
         
         ### update self.unoccupied_time: bias movement toward open spaces
         for x in range(width):
@@ -75,43 +84,29 @@ class Player:
                     
         
         ### Make a "map" of distance to closest non-owned square
-        dist_to_unowned = [ [999] * height for i in range(width) ]
-        open = [] # open list
+        # Non-owned squares are the seeds. The field is kept from last turn and
+        # only repaired where the seeds or costs changed.
+        seeds = []
+        costs = []
         for x in range(width):
             for y in range(height):
                 food = 1.0 - self.money_payout_rates[x][y]
                 attractiveness = self.unoccupied_time[x][y] * (1 + food)
-                if not guys[x][y]:
-                    open.append( (-attractiveness,x,y) )
-                else:
-                    num_guys, is_mine = guys[x][y]
-                    if not is_mine:
-                        open.append( (-attractiveness,x,y) )
-        
-        for d, x, y in open:
-            dist_to_unowned[x][y] = d
-        # Djikstra to fill out map
-        heapq.heapify(open)
-        while len(open) > 0:
-            d, x, y = heapq.heappop(open)
-            if dist_to_unowned[x][y] < d:
-                continue # Better dist found already
-            for m in MOVE_ACTIONS:
-                x2, y2 = actions.next_pos( (x,y), m)
-                if not self.in_bounds(x2, y2):
-                    continue
                 # Bias around enemy guys
                 # and places there are lots of my guys already
                 cost = 1
-                if guys[x2][y2]:
-                    num_guys, is_mine = guys[x2][y2]
+                seed = -attractiveness
+                if guys[x][y]:
+                    num_guys, is_mine = guys[x][y]
                     if is_mine:
-                        cost = 1 + 0.1*num_guys
+                        cost = 1 + self.crowding*num_guys
+                        seed = None
                     else:
                         cost = num_guys
-                if dist_to_unowned[x2][y2] > d + cost:
-                    dist_to_unowned[x2][y2] = d + cost
-                    heapq.heappush(open, (d + cost, x2, y2))
+                seeds.append(seed)
+                costs.append(cost)
+        self.dist_field.update(seeds, costs)
+        dist_to_unowned = self.dist_field.grid()
         # for y in range(height):
             # for x in range(width):
                 # print dist_to_unowned[x][y],
@@ -132,20 +127,18 @@ class Player:
                     action = None
                     best_dist = 999
                     best_food = 0.0
-                    for m in MOVE_ACTIONS:
-                        x2, y2 = actions.next_pos( (x,y), m)
-                        if not self.in_bounds(x2, y2):
-                            continue
+                    best_x, best_y = x, y
+                    for m, x2, y2 in self.neighbours[x][y]:
                         dist = dist_to_unowned[x2][y2]
                         food = 1.0 - self.money_payout_rates[x2][y2]
                         if dist < best_dist or (dist == best_dist and food > best_food):
                             action = m
                             best_dist = dist
                             best_food = food
+                            best_x, best_y = x2, y2
                     # Make pos less attractive so others spread out (occasionally)
-                    if random.random() > 0.9:
-                        x2, y2 = actions.next_pos( (x,y), action)
-                        dist_to_unowned[x2][y2] += 0.1
+                    if random.random() > 1 - self.spread_chance:
+                        dist_to_unowned[best_x][best_y] += self.spread_amount
                     
                     # Give the order
                     key = ((x, y), action)
@@ -12,30 +12,54 @@
 # Author: Glen Robertson (phoglenix)
 
 import actions
-import heapq
+from distfield import DistanceField, split_stack
+from mapanalysis import MapAnalysis
 import random
 
 class Player:
-    def __init__(self, money_payout_rates, my_spawn_point, their_spawn_point):
+    # Be given the map's food grid and each tile's neighbours ready made
+    MAP_ANALYSIS = True
+
+    # The magic numbers can be given as keyword arguments, for tune.py:
+    # attraction scales how attractive a tile is for how long it's been left
+    # alone and its food, crowding is how much each of my guys on a tile puts
+    # others off going through it, a guy sent to a tile makes it spread_amount
+    # less attractive spread_chance of the time, and the first guy on a tile
+    # stays put after turn stay_after.
+    # PARAM_RANGES are the (lowest, highest) values that make sense, None for
+    # no limit, which tune.py checks before playing any games.
+    PARAM_RANGES = {'attraction': (0, None), 'crowding': (0, None),
+                    'spread_chance': (0, 1), 'spread_amount': (0, None),
+                    'stay_after': (0, None)}
+
+    def __init__(self, money_payout_rates, my_spawn_point, their_spawn_point,
+                 analysis=None, attraction=0.1, crowding=0.1, spread_chance=0.1,
+                 spread_amount=0.1, stay_after=500):
         self.money_payout_rates = money_payout_rates
         self.my_spawn_point = my_spawn_point
         self.their_spawn_point = their_spawn_point
         self.width = len(self.money_payout_rates)
         self.height = len(self.money_payout_rates[0])
+        # Make our own analysis if the game didn't give us one
+        if analysis is None:
+            analysis = MapAnalysis(money_payout_rates, my_spawn_point, their_spawn_point)
+        self.food = analysis.food
+        self.neighbours = analysis.neighbours
         # Grid of amount of time each tile has been left unoccupied
         self.unoccupied_time = [ [0] * self.height for i in range(self.width) ]
+        # Distance/attractiveness grid, kept between turns
+        self.dist_field = DistanceField(self.width, self.height)
         # Turn number
         self.turn_no = 0
-        # Just the movement actions (ie ignore "STAY")
-        self.MOVE_ACTIONS = actions.ALL_ACTIONS[1:]
-    
-    # Convenience method to check if a position is on the grid
-    def in_bounds(self, x, y):
-        if not 0 <= x < self.width:
-            return False
-        if not 0 <= y < self.height:
-            return False
-        return True
+        self.attraction = attraction
+        self.crowding = crowding
+        self.spread_chance = spread_chance
+        self.spread_amount = spread_amount
+        self.stay_after = stay_after
+        # How much a tile's distance goes up when a guy is sent there: a
+        # spread_chance of making it spread_amount less attractive, as in
+        # get_order
+        self.SPREAD_STEP = spread_chance * spread_amount
     
     # Convenience method to get the food at a position
     def get_food(self, x, y):
@@ -45,16 +69,16 @@ class Player:
     def is_mine(self, x, y, guys):
         return guys[x][y] and guys[x][y][1]
     
-    # Remove one of my guys from x,y and add the guy to x2,y2
+    # Remove count of my guys from x,y and add them to x2,y2
     # For recording the effect of an order
-    # Will error if no guys were at x,y or enemy guys were at x,y
-    def update_guys(self, x, y, x2, y2, guys):
+    # Will error if not enough guys were at x,y or enemy guys were at x,y
+    def update_guys(self, x, y, x2, y2, guys, count=1):
         assert guys[x][y]
         num_guys, is_mine = guys[x][y]
         assert is_mine
-        assert num_guys > 0
+        assert num_guys >= count
         # Remove from source
-        num_guys -= 1
+        num_guys -= count
         if num_guys == 0:
             guys[x][y] = None
         else:
@@ -63,14 +87,17 @@ class Player:
         if guys[x2][y2]:
             num_guys, is_mine = guys[x2][y2]
             if is_mine:
-                num_guys += 1
+                num_guys += count
             else:
-                num_guys -= 1
+                num_guys -= count
                 if num_guys == 0:
                     guys[x2][y2] = None
                     return
+                elif num_guys < 0:
+                    # Killed them all and some of mine are left
+                    num_guys, is_mine = -num_guys, True
         else:
-            num_guys, is_mine = 1, True
+            num_guys, is_mine = count, True
         guys[x2][y2] = (num_guys, is_mine)
     
     # Find the best action for one chicken at x,y, given grid of current guys,
@@ -78,13 +105,12 @@ class Player:
     # chicken on the tile (which has to stay unless there's a vacant better-food
     # spot neighbouring)
     def get_order(self, x, y, guys, dist_to_unowned, first):
+        food_grid = self.food
         best_action = None
         best_dist = 999
         best_food = 0.0
-        for action in self.MOVE_ACTIONS:
-            x2, y2 = actions.next_pos( (x,y), action)
-            if not self.in_bounds(x2, y2):
-                continue
+        best_x, best_y = x, y
+        for action, x2, y2 in self.neighbours[x][y]:
             dist = dist_to_unowned[x2][y2]
             # First ignores distance, only interested in food and unowned tiles
             if first:
@@ -92,30 +118,50 @@ class Player:
                     dist = 999
                 else:
                     dist = 0
-            food = self.get_food(x2, y2)
+            food = food_grid[x2][y2]
             if dist < best_dist or (dist == best_dist and food > best_food):
                 best_action = action
                 best_dist = dist
                 best_food = food
+                best_x, best_y = x2, y2
         
-        x2, y2 = actions.next_pos( (x,y), best_action) # New pos
+        x2, y2 = best_x, best_y # New pos
         if first:
             # First guy can't move if it's to a worse food spot...
             # or my guys are there already
             # or we're near the end of the game
-            if self.get_food(x2, y2) <= self.get_food(x, y) \
+            if food_grid[x2][y2] <= food_grid[x][y] \
                or self.is_mine(x2, y2, guys) \
-               or self.turn_no > 500:
+               or self.turn_no > self.stay_after:
                 return ((x, y), actions.STAY)
         
         # Make pos less attractive so others spread out (occasionally)
-        if random.random() > 0.9:
-            dist_to_unowned[x2][y2] += 0.1
+        if random.random() > 1 - self.spread_chance:
+            dist_to_unowned[x2][y2] += self.spread_amount
         # Update guys
         self.update_guys(x, y, x2, y2, guys)
         # Give the order
         return ((x, y), best_action)
     
+    # Orders for count guys at x,y that aren't the first guy there, all in one
+    # go rather than a get_order each. Sending them one by one to the best
+    # tile and making it a little less attractive each time fills up the
+    # neighbours' distances like water, so split_stack works out the same
+    # spread directly. Returns a list of (order, number of guys).
+    def get_stack_orders(self, x, y, count, guys, dist_to_unowned):
+        moves = self.neighbours[x][y]
+        choices = [(dist_to_unowned[x2][y2], self.food[x2][y2]) for action, x2, y2 in moves]
+        
+        orders = []
+        shares = split_stack(count, choices, self.SPREAD_STEP)
+        for (action, x2, y2), number in zip(moves, shares):
+            if number == 0:
+                continue
+            dist_to_unowned[x2][y2] += number * self.SPREAD_STEP
+            self.update_guys(x, y, x2, y2, guys, number)
+            orders.append((((x, y), action), number))
+        return orders
+    
     # Gets called each turn and where you decide where your chickens will go
     def take_turn(self, guys, my_food, their_food, my_money, their_money):
         # Update turn number
@@ -132,43 +178,34 @@ class Player:
         
         # Make a grid of distance to closest non-owned tile
         # This got twisted into becoming a general attractiveness measure
-        dist_to_unowned = [ [999] * self.height for i in range(self.width) ]
-        open = [] # open list of seeds to grow a distance/attractiveness grid
+        # The grid is kept from last turn and only repaired where the seeds or
+        # costs changed.
+        seeds = [] # seeds to grow a distance/attractiveness grid
+        costs = []
+        food_grid = self.food
         for x in range(self.width):
             for y in range(self.height):
                 # Longer unowned and higher food tiles are more attractive.
                 # Magic numbers seemed to help so it wouldn't be overwhelmed by
                 # attraction to unoccupied area
-                attractiveness = self.unoccupied_time[x][y] * (1 + self.get_food(x,y)) * 0.1
+                attractiveness = self.unoccupied_time[x][y] * (1 + food_grid[x][y]) * self.attraction
                 # Only add non-owned tiles
-                if not self.is_mine(x, y, guys):
-                    # Attraction is represented as negative distance
-                    open.append( (-attractiveness, x, y) )
-        
-        for d, x, y in open:
-            dist_to_unowned[x][y] = d
-        # Djikstra's algorithm to fill out grid of shortest distances
-        heapq.heapify(open)
-        while len(open) > 0:
-            d, x, y = heapq.heappop(open)
-            if dist_to_unowned[x][y] < d:
-                continue # Shorter dist found already
-            for m in self.MOVE_ACTIONS:
-                x2, y2 = actions.next_pos( (x,y), m)
-                if not self.in_bounds(x2, y2):
-                    continue
+                # Attraction is represented as negative distance
+                seed = -attractiveness
                 # Bias around enemy guys
                 # and places there are lots of my guys already
                 cost = 1
-                if guys[x2][y2]:
-                    num_guys, is_mine = guys[x2][y2]
+                if guys[x][y]:
+                    num_guys, is_mine = guys[x][y]
                     if is_mine:
-                        cost = 1 + 0.1*num_guys
+                        cost = 1 + self.crowding*num_guys
+                        seed = None
                     else:
                         cost = num_guys
-                if dist_to_unowned[x2][y2] > d + cost:
-                    dist_to_unowned[x2][y2] = d + cost
-                    heapq.heappush(open, (d + cost, x2, y2))
+                seeds.append(seed)
+                costs.append(cost)
+        self.dist_field.update(seeds, costs)
+        dist_to_unowned = self.dist_field.grid()
         
         # Make a list of all my guys, sorted by most to least food
         # Sorting was originally to help guys move toward higher food but I
@@ -178,7 +215,7 @@ class Player:
             for y in range(self.height):
                 if not self.is_mine(x, y, guys): continue
                 num_guys, is_mine = guys[x][y]
-                all_guys.append( (self.get_food(x,y), x, y, num_guys) )
+                all_guys.append( (food_grid[x][y], x, y, num_guys) )
         all_guys.sort(reverse=True)
         
         # Get the best order for each guy. Record where guys still can move
@@ -187,18 +224,19 @@ class Player:
         orders = {}
         still_can_move = {}
         for unused, x, y, num_guys in all_guys:
-            for i in range(num_guys):
-                # Get the best order for this guy
-                position, action = self.get_order(x, y, guys, dist_to_unowned, i == 0)
-                
-                if action == actions.STAY:
-                    still_can_move[position] = True
-                else:
-                    order = (position, action)
-                    if order not in orders:
-                        orders[order] = 1
-                    else:
-                        orders[order] += 1
+            # Get the best order for the first guy
+            position, action = self.get_order(x, y, guys, dist_to_unowned, True)
+            
+            if action == actions.STAY:
+                still_can_move[position] = True
+            else:
+                order = (position, action)
+                orders[order] = orders.get(order, 0) + 1
+            # And the rest of the stack all at once
+            if num_guys > 1:
+                for order, number in self.get_stack_orders(x, y, num_guys - 1,
+                                                           guys, dist_to_unowned):
+                    orders[order] = orders.get(order, 0) + number
         # Try moving the guys that still_can_move if other guys have moved into their square
         # Iterate over orders looking to see if destination square still can move
         open = orders.keys()
@@ -0,0 +1,180 @@
+""" Players that run in their own worker process.
+
+A ProcessPlayer starts a long-lived process holding the real bot, and stands
+in for it in the game.  Each turn the occupied cells are sent to the worker
+over a pipe, as a list of cells numbered x * height + y and a list of how
+many guys are on each: +n for n of the bot's guys, -n for n of the other
+player's (two lists of ints pickle much faster than a list of pairs).  The
+worker builds the usual guys argument from them, calls the bot's take_turn
+and sends the orders back down the pipe.  Only the occupied cells are ever
+sent or looked at, so a big sparse board costs no more than its chickens.
+
+With the game's concurrent mode both workers think at the same time, so a turn
+takes as long as the slower bot rather than both added up, and a bot that
+crashes or blows up its interpreter only takes its own process down.
+
+Each worker's random module is seeded from the map's seed and the player
+number, so a bot that uses it plays the same way every time on the same seed.
+It still won't play the same as in the game's own process, where both bots
+draw from the one random module seeded by play_game.
+
+python game.py --processes mybot1.py mybot2.py
+"""
+import importlib
+import multiprocessing
+import random
+from traceback import format_exc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from map import Population, Income, DENSE, SHARED, ARRAYS, BoardArrays, make_guys, read_only
+from mapanalysis import MapAnalysis
+
+
+class WorkerError(Exception):
+    """ The bot in a worker process crashed, or the worker died """
+    pass
+
+
+class WorkerArrays:
+    """ The guys argument for a bot with ARRAYS turn data, filled in from
+    the occupied cells.  The bot is given views of the same two arrays every
+    turn, filled in place, so nothing is made each turn. """
+    def __init__(self, width, height, money_payout_rates):
+        if numpy is None:
+            raise ImportError('arrays turn data needs NumPy')
+        self.mine = numpy.zeros((width, height), dtype=numpy.int64)
+        self.theirs = numpy.zeros((width, height), dtype=numpy.int64)
+        rates = numpy.array(money_payout_rates, dtype=numpy.float64)
+        self.views = (read_only(self.mine), read_only(self.theirs), read_only(rates))
+
+    def guys(self, cells, counts, incomes):
+        self.mine.fill(0)
+        self.theirs.fill(0)
+        if cells:
+            index = numpy.array(cells, dtype=numpy.int64)
+            counts = numpy.array(counts, dtype=numpy.int64)
+            mine = counts > 0
+            self.mine.reshape(-1)[index[mine]] = counts[mine]
+            self.theirs.reshape(-1)[index[~mine]] = -counts[~mine]
+        return BoardArrays(*(self.views + tuple(incomes)))
+
+
+def worker_main(conn, module, width, height, constructor_data, params, seed):
+    """ Runs in the worker: make the bot, then play turns until told to stop.
+    seed is for the random module, or None to seed it from the system. """
+    # Both workers start with a copy of the game's random state, so without
+    # this they would draw the same numbers
+    random.seed(seed)
+    try:
+        Player = importlib.import_module(module).Player
+        if getattr(Player, 'MAP_ANALYSIS', False):
+            # Made here rather than pickled over from the game
+            constructor_data += (MapAnalysis(*constructor_data),)
+        player = Player(*constructor_data, **params)
+        style = getattr(player, 'TURN_DATA', DENSE)
+        if style == ARRAYS:
+            arrays = WorkerArrays(width, height, constructor_data[0])
+    except:
+        conn.send(('crashed', format_exc()))
+        return
+    last_seen = {}
+    conn.send(('ready', style))
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        turn_data, cells, counts, incomes = message
+        incomes = [Income(*income) for income in incomes]
+        if style == ARRAYS:
+            guys = arrays.guys(cells, counts, incomes)
+        else:
+            occupied = []
+            for i, n in zip(cells, counts):
+                x, y = divmod(i, height)
+                occupied.append((x, y, Population(abs(n), n > 0)))
+            guys = make_guys(width, height, occupied, style, last_seen, incomes)
+        try:
+            orders = player.take_turn(guys, *turn_data)
+        except:
+            conn.send(('crashed', format_exc()))
+            return
+        conn.send(('orders', orders))
+
+
+class ProcessPlayer:
+    """ Plays the bot in module (a name like "phoglenix3") in a worker process,
+    as player 1 or 2 on map m.  params are keyword arguments for its Player. """
+    TURN_DATA = SHARED
+
+    def __init__(self, module, m, player_no, params=None):
+        self.map = m
+        self.is_p1 = player_no == 1
+        self.height = m.height
+        if self.is_p1:
+            constructor_data = m.constructor_data_for_p1()
+        else:
+            constructor_data = m.constructor_data_for_p2()
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=worker_main,
+            args=(child_conn, module, m.width, m.height, constructor_data,
+                  params or {}, self.__seed(m.seed, player_no)))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.__reply('ready')
+
+    def __seed(self, map_seed, player_no):
+        """ The worker's random seed: different for each player, and the
+        same every time for a given map seed """
+        if map_seed is None:
+            return None
+        return map_seed * 2 + player_no - 1
+
+    def __reply(self, expected):
+        try:
+            kind, value = self.conn.recv()
+        except (EOFError, IOError):
+            raise WorkerError('worker process died')
+        if kind == 'crashed':
+            raise WorkerError(value)
+        assert kind == expected
+        return value
+
+    def __cells(self):
+        """ The occupied cells, and the guys on each as this player sees them """
+        height, is_p1 = self.height, self.is_p1
+        occupied = self.map.occupied_cells()
+        cells = [x * height + y for x, y, num_guys, p1_owns in occupied]
+        counts = [num_guys if p1_owns == is_p1 else -num_guys
+                  for x, y, num_guys, p1_owns in occupied]
+        return cells, counts
+
+    def take_turn(self, guys, my_food, their_food, my_money, their_money):
+        """ guys is ignored (it's None with SHARED turn data); the worker is
+        sent the occupied cells of the map instead """
+        cells, counts = self.__cells()
+        incomes = (self.map.income_for_p1(), self.map.income_for_p2())
+        if not self.is_p1:
+            incomes = incomes[::-1]
+        try:
+            self.conn.send(((my_food, their_food, my_money, their_money), cells, counts,
+                            incomes))
+        except IOError:
+            raise WorkerError('worker process died')
+        return self.__reply('orders')
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except IOError:
+            pass # Already gone
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
@@ -0,0 +1,138 @@
+""" Timing for the game loop: how long each bot's turn and each phase of the
+engine takes, every turn.
+
+Times are wall clock.  Memory is the growth of the process's resident size
+over a phase (read from /proc, so only on Linux), which shows a bot or phase
+that allocates a lot.  When both bots take their turns at once their memory
+growth is mixed together.
+
+Each turn can be written to a CSV, one row per turn with a _ms and a _kb
+column per phase, and summary() gives totals and percentiles per phase for
+the end of the game log. """
+import os
+import csv
+import time
+
+PHASES = ['turn_data', 'p1_turn', 'p2_turn', 'apply_moves', 'resolve_combat',
+          'give_payouts', 'spawn_new_guys', 'log']
+
+try:
+    PAGE_KB = os.sysconf('SC_PAGE_SIZE') / 1024
+    open('/proc/self/statm').close()
+except (ValueError, OSError, IOError, AttributeError):
+    PAGE_KB = None
+
+
+def resident_kb():
+    """ The process's resident size in KB, or 0 if we can't tell """
+    if PAGE_KB is None:
+        return 0
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_KB
+
+
+def percentile(values, fraction):
+    """ The value fraction of the way through sorted values """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Phase:
+    """ Context manager adding the time and memory of a block to a phase """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.memory:
+            self.start_kb = resident_kb()
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        turn = self.profiler.turn
+        turn[self.name] = turn.get(self.name, 0.0) + elapsed
+        if self.profiler.memory:
+            grown = resident_kb() - self.start_kb
+            kb = self.profiler.turn_kb
+            kb[self.name] = kb.get(self.name, 0) + grown
+
+
+class TurnProfiler:
+    def __init__(self, csv_path=None, memory=True):
+        """ Phase times are kept for every turn for summary(), and written to
+        csv_path if it's given.  memory=False skips the memory readings. """
+        self.memory = memory and PAGE_KB is not None
+        self.history = dict((name, []) for name in PHASES)
+        self.total_kb = dict((name, 0) for name in PHASES)
+        self.overruns = dict((name, 0) for name in PHASES)
+        self.turn = {}
+        self.turn_kb = {}
+        self.turn_no = 0
+        self.csv_file = self.writer = None
+        if csv_path:
+            self.csv_file = open(csv_path, 'wb')
+            self.writer = csv.writer(self.csv_file)
+            columns = ['turn'] + ['%s_ms' % name for name in PHASES]
+            if self.memory:
+                columns += ['%s_kb' % name for name in PHASES]
+            self.writer.writerow(columns)
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def elapsed(self, name):
+        """ Seconds spent in a phase so far this turn """
+        return self.turn.get(name, 0.0)
+
+    def overrun(self, name):
+        """ Count a turn that went over the deadline """
+        self.overruns[name] += 1
+
+    def end_turn(self):
+        for name in PHASES:
+            self.history[name].append(self.turn.get(name, 0.0))
+            self.total_kb[name] += self.turn_kb.get(name, 0)
+        if self.writer:
+            row = [self.turn_no] + ['%.3f' % (1000 * self.turn.get(name, 0.0))
+                                    for name in PHASES]
+            if self.memory:
+                row += [self.turn_kb.get(name, 0) for name in PHASES]
+            self.writer.writerow(row)
+        self.turn = {}
+        self.turn_kb = {}
+        self.turn_no += 1
+
+    def summary(self):
+        """ {phase: {total_ms, mean_ms, p50_ms, p95_ms, max_ms, grown_kb,
+        overruns}} over all the turns so far """
+        summary = {}
+        for name in PHASES:
+            times = sorted(self.history[name])
+            if not times:
+                continue
+            summary[name] = {
+                'total_ms': round(1000 * sum(times), 3),
+                'mean_ms': round(1000 * sum(times) / len(times), 3),
+                'p50_ms': round(1000 * percentile(times, 0.5), 3),
+                'p95_ms': round(1000 * percentile(times, 0.95), 3),
+                'max_ms': round(1000 * times[-1], 3),
+                'grown_kb': self.total_kb[name],
+                'overruns': self.overruns[name],
+            }
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print '%-16s %10s %9s %9s %9s %9s %9s %8s' % ('phase', 'total ms', 'mean',
+              'p50', 'p95', 'max', 'grown kb', 'overrun')
+        for name in PHASES:
+            if name in summary:
+                s = summary[name]
+                print '%-16s %10.1f %9.3f %9.3f %9.3f %9.3f %9d %8d' % (name,
+                      s['total_ms'], s['mean_ms'], s['p50_ms'], s['p95_ms'],
+                      s['max_ms'], s['grown_kb'], s['overruns'])
+
+    def close(self):
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = self.writer = None
@@ -2,6 +2,10 @@ import actions
 import random
 
 class Player:
+    # Ask for the guys on the board as a list of occupied spots as well as the
+    # usual grid (explained in take_turn below)
+    TURN_DATA = 'sparse'
+
     #Get passed all the board information that never changes throughout the game.
     #It is recommended that you store these in member variables since you will probably need to look at them later.
     # PARAMS:
@@ -31,6 +35,12 @@ class Player:
     #       An entry of 'None' indicates an unoccupied spot.
     #       A space with chickens will be an object with "num_guys" and "is_mine" properties.
     #
+    #       Because this bot sets TURN_DATA = 'sparse' (at the top), guys also has:
+    #         guys.occupied: a list of (x, y, population) for just the occupied spots,
+    #           so you don't have to look through all 2500 of them.
+    #         guys.changed: a list of (x, y, population) for the spots that changed
+    #           since last turn.  population is None if the spot is now empty.
+    #       Leave TURN_DATA out and guys is a plain 2D list.
 
     #   my_food:
     #       A float showing how much food you have left over from last turn.
@@ -49,17 +59,10 @@ class Player:
     #   direction is defined in action.py
 
     def take_turn(self, guys, my_food, their_food, my_money, their_money):
-        width = len(guys)
-        height = len(guys[0])
-
         orders = {}
-        for x in range(width):
-            for y in range(height):
-                if not guys[x][y]: continue
-
-                num_guys, is_mine = guys[x][y]
-                if not is_mine: continue
+        for x, y, (num_guys, is_mine) in guys.occupied:
+            if not is_mine: continue
 
-                orders[((x, y), random.choice(actions.ALL_ACTIONS))] = num_guys - 1
+            orders[((x, y), random.choice(actions.ALL_ACTIONS))] = num_guys - 1
 
         return orders
@@ -0,0 +1,421 @@
+""" Game log writers that stream each turn to disk as it is played, instead of
+keeping the whole game in memory until the end.
+
+Three formats are written, picked by the file name:
+
+    game_log.js          The window.game = {...} file that viz.html loads.
+                         Every keyframe_interval turns is a keyframe with all
+                         the occupied cells in p1g and p2g; the turns between
+                         only have the cells that changed, in p1d and p2d.
+                         "aggregates" has each player's population, money and
+                         income for every turn, for the graphs.
+    game_log.jsonl[.gz]  A compact log: a JSON header line with the map, then
+                         one JSON line per turn holding only the cells that
+                         changed since the turn before.  Optionally gzipped.
+    game.orders.jsonl[.gz]
+                         An orders log: a JSON header line with the map seed
+                         and size and the spawn points, then one JSON line per
+                         turn with the moves each player's orders made.  The
+                         boards are got back by playing the moves again on a
+                         new map (see ReplaySimulator).  Optionally gzipped.
+
+Turn the compact or orders format into one viz.html can show with
+
+python replay.py game_log.jsonl.gz game_log.js
+"""
+import sys
+import copy
+import json
+import gzip
+
+import actions
+import orders
+from map import Map
+
+FORMAT_VERSION = 1
+# Turns from one game_log.js keyframe to the next
+KEYFRAME_INTERVAL = 50
+
+
+class JsReplayWriter:
+    """ Writes the window.game = {...} format viz.html expects, one turn at a
+    time.  If the game dies part way through, close() still leaves a
+    complete file with the turns played so far. """
+    def __init__(self, path, header, keyframe_interval=KEYFRAME_INTERVAL):
+        self.f = open(path, 'w')
+        self.f.write('window.game = {')
+        header = dict(header, keyframe_interval=keyframe_interval)
+        for key in sorted(header):
+            self.f.write('%s: %s, ' % (json.dumps(key), json.dumps(header[key])))
+        self.f.write('"turns": [')
+        self.keyframe_interval = keyframe_interval
+        self.num_turns = 0
+        self.last = {'p1g': {}, 'p2g': {}}
+        self.aggregates = dict((key, []) for key in
+                               ('p1_guys', 'p2_guys', 'p1_money', 'p2_money',
+                                'p1_income', 'p2_income'))
+        self.profile = None
+
+    def write_turn(self, state):
+        line = {'p1m': state['p1m'], 'p2m': state['p2m']}
+        keyframe = self.num_turns % self.keyframe_interval == 0
+        for player in ('p1', 'p2'):
+            cells = state[player + 'g']
+            if player + 'i' in state:
+                line[player + 'i'] = state[player + 'i']
+            if keyframe:
+                line[player + 'g'] = cells
+            current = dict(((x, y), n) for x, y, n in cells)
+            if not keyframe:
+                line[player + 'd'] = changed_cells(self.last[player + 'g'], current)
+            self.last[player + 'g'] = current
+
+            self.aggregates[player + '_guys'].append(sum(n for x, y, n in cells))
+            self.aggregates[player + '_money'].append(state[player + 'm'])
+            self.aggregates[player + '_income'].append(state.get(player + 'i'))
+        if self.num_turns:
+            self.f.write(', ')
+        self.f.write(json.dumps(line, separators=(',', ':')))
+        self.num_turns += 1
+
+    def write_orders(self, p1_actions, p2_actions):
+        pass # The boards are written instead
+
+    def write_profile(self, summary):
+        """ Add the game's timing summary after the turns, as "profile" """
+        self.profile = summary
+
+    def close(self):
+        self.f.write('], "aggregates": %s' % json.dumps(self.aggregates, separators=(',', ':')))
+        if self.profile is not None:
+            self.f.write(', "profile": %s' % json.dumps(self.profile))
+        self.f.write('}')
+        self.f.close()
+
+
+class DeltaReplayWriter:
+    """ Writes the compact log: a header line, then for each turn both
+    players' money and income and [x, y, num_guys] for every cell whose count
+    changed since the turn before (num_guys 0 when a cell was emptied). """
+    def __init__(self, path, header, compress=False):
+        if compress:
+            self.f = gzip.open(path, 'wb')
+        else:
+            self.f = open(path, 'w')
+        header = dict(header, version=FORMAT_VERSION)
+        self.f.write(json.dumps(header) + '\n')
+        self.last = {'p1g': {}, 'p2g': {}}
+
+    def write_turn(self, state):
+        line = {'p1m': state['p1m'], 'p2m': state['p2m']}
+        for key in ('p1i', 'p2i'):
+            if key in state:
+                line[key] = state[key]
+        for key in ('p1g', 'p2g'):
+            cells = dict(((x, y), n) for x, y, n in state[key])
+            line[key] = changed_cells(self.last[key], cells)
+            self.last[key] = cells
+        self.f.write(json.dumps(line, separators=(',', ':')) + '\n')
+        # Push each turn out to disk, so a crash doesn't lose the turns so far
+        self.f.flush()
+
+    def write_orders(self, p1_actions, p2_actions):
+        pass # The boards are written instead
+
+    def write_profile(self, summary):
+        """ Add the game's timing summary as a last {"profile": ...} line """
+        self.f.write(json.dumps({'profile': summary}, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.f.close()
+
+
+# The moves of an orders log are coded by direction as quantity * 4 + code
+MOVE_DIRECTIONS = [actions.UP, actions.RIGHT, actions.DOWN, actions.LEFT]
+
+
+class OrdersReplayWriter:
+    """ Writes the orders log: a header line, then a line for each turn with
+    the moves each player's orders made that turn.  The map is made again
+    from its seed to play them back, so m must have been made with a seed.
+
+    A player's moves are in "p1"/"p2", ordered by the cell they leave (as
+    x * height + y), each as [cells on from the cell of the move before,
+    quantity * 4 + MOVE_DIRECTIONS.index(direction)].  The few dict orders
+    that leave from a cell given as a negative x or y don't end up next to
+    it, and are kept as [x, y, new_x, new_y, quantity] in "p1x"/"p2x". """
+    def __init__(self, path, m, compress=False):
+        if m.seed is None:
+            raise ValueError('an orders log needs a map made from a seed')
+        if compress:
+            self.f = gzip.open(path, 'wb')
+        else:
+            self.f = open(path, 'w')
+        self.map = m
+        header = {'version': FORMAT_VERSION, 'seed': m.seed,
+                  'width': m.width, 'height': m.height,
+                  'num_hills': m.num_hills, 'hill_size': m.hill_size,
+                  'p1_spawn': m.p1_spawn, 'p2_spawn': m.p2_spawn}
+        self.f.write(json.dumps(header) + '\n')
+        self.last = None
+
+    def write_turn(self, state):
+        # Only kept to check the money of the last turn against when playing back
+        self.last = state
+
+    def write_orders(self, p1_actions, p2_actions):
+        """ Log the moves that p1_actions and p2_actions make on the map as it
+        is now, before they are applied """
+        m = self.map
+        line = {}
+        for player, player_actions, guys in (('p1', p1_actions, m.p1_guys),
+                                             ('p2', p2_actions, m.p2_guys)):
+            moves = orders.accepted_moves(player_actions, guys, m.width, m.height)
+            line[player], odd = encode_moves(moves, m.height)
+            if odd:
+                line[player + 'x'] = odd
+        self.f.write(json.dumps(line, separators=(',', ':')) + '\n')
+        self.f.flush()
+
+    def write_profile(self, summary):
+        """ Add the game's timing summary as a last {"profile": ...} line """
+        self.f.write(json.dumps({'profile': summary}, separators=(',', ':')) + '\n')
+
+    def close(self):
+        # The end money, so the game can be checked when it's played back
+        if self.last is not None:
+            self.f.write(json.dumps({'p1m': self.last['p1m'], 'p2m': self.last['p2m']}) + '\n')
+        self.f.close()
+
+
+def encode_moves(moves, height):
+    """ (coded moves, odd moves) of an orders log line from a list of
+    (x, y, new_x, new_y, quantity), leaving out moves that don't move
+    anything """
+    coded = []
+    odd = []
+    for x, y, new_x, new_y, quantity in sorted(moves):
+        quantity = int(quantity)
+        if quantity == 0 or (new_x, new_y) == (x, y):
+            continue
+        offset = (new_x - x, new_y - y)
+        direction = None
+        for d in MOVE_DIRECTIONS:
+            if actions.OFFSETS[d] == offset:
+                direction = d
+        if direction is None:
+            odd.append([x, y, new_x, new_y, quantity])
+        else:
+            coded.append((x * height + y, quantity * 4 + MOVE_DIRECTIONS.index(direction)))
+    line = []
+    last = 0
+    for cell, code in coded:
+        line.append([cell - last, code])
+        last = cell
+    return line, odd
+
+
+def decode_moves(line, odd, height):
+    """ The (x, y, new_x, new_y, quantity) moves coded by encode_moves """
+    moves = []
+    cell = 0
+    for step, code in line:
+        cell += step
+        x, y = divmod(cell, height)
+        quantity, direction = divmod(code, 4)
+        x_off, y_off = actions.OFFSETS[MOVE_DIRECTIONS[direction]]
+        moves.append((x, y, x + x_off, y + y_off, quantity))
+    moves.extend(tuple(move) for move in odd)
+    return moves
+
+
+def changed_cells(old, new):
+    """ [x, y, num_guys] for every cell that differs between two
+    {(x, y): num_guys} dicts, with num_guys 0 for cells that are gone """
+    changed = [[x, y, n] for (x, y), n in new.iteritems() if old.get((x, y)) != n]
+    changed += [[x, y, 0] for (x, y) in old if (x, y) not in new]
+    changed.sort()
+    return changed
+
+
+def is_orders_log(path):
+    return path.endswith('.orders.jsonl') or path.endswith('.orders.jsonl.gz')
+
+
+def open_writer(path, m):
+    """ A replay writer for map m, in the format given by the name of path """
+    if is_orders_log(path):
+        return OrdersReplayWriter(path, m, compress=path.endswith('.gz'))
+    header = m.to_struct()
+    if path.endswith('.jsonl'):
+        return DeltaReplayWriter(path, header)
+    if path.endswith('.gz'):
+        return DeltaReplayWriter(path, header, compress=True)
+    return JsReplayWriter(path, header)
+
+
+def read_delta_replay(path):
+    """ (header, turns) from a compact log, turns being a generator of the full
+    board_state_for_json() dict of each turn.  A log cut short by a crash
+    gives the turns written before the crash.  Once all the turns are read,
+    header['profile'] holds the game's timing summary, if it has one. """
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path)
+    header = json.loads(f.readline())
+
+    def turns():
+        cells = {'p1g': {}, 'p2g': {}}
+        try:
+            for line in f:
+                if not line.endswith('\n'):
+                    break # Cut off part way through writing the turn
+                delta = json.loads(line)
+                if 'profile' in delta:
+                    header['profile'] = delta['profile']
+                    continue
+                state = {'p1m': delta['p1m'], 'p2m': delta['p2m']}
+                for key in ('p1i', 'p2i'):
+                    if key in delta:
+                        state[key] = delta[key]
+                for key in ('p1g', 'p2g'):
+                    for x, y, n in delta[key]:
+                        if n:
+                            cells[key][x, y] = n
+                        else:
+                            del cells[key][x, y]
+                    state[key] = [[x, y, n] for (x, y), n in sorted(cells[key].iteritems())]
+                yield state
+        except (IOError, EOFError):
+            pass # The end of a gzip file that was never closed
+        f.close()
+    return header, turns()
+
+
+def read_orders_replay(path):
+    """ (header, turns) from an orders log, turns being a list of each turn's
+    (p1 moves, p2 moves) as accepted_moves gives them.  header['profile']
+    and header['end'] (the last turn's {"p1m", "p2m"}) are set if the log
+    has them; a log cut short by a crash has neither. """
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path)
+    header = json.loads(f.readline())
+    height = header['height']
+    turns = []
+    try:
+        for line in f:
+            if not line.endswith('\n'):
+                break # Cut off part way through writing the turn
+            line = json.loads(line)
+            if 'profile' in line:
+                header['profile'] = line['profile']
+            elif 'p1m' in line:
+                header['end'] = line
+            else:
+                turns.append((decode_moves(line['p1'], line.get('p1x', []), height),
+                              decode_moves(line['p2'], line.get('p2x', []), height)))
+    except (IOError, EOFError):
+        pass # The end of a gzip file that was never closed
+    f.close()
+    return header, turns
+
+
+class ReplaySimulator:
+    """ Plays an orders log back on a new map made from the log's seed.  The
+    whole board is kept every snapshot_interval turns, so state(turn) only
+    plays on from the nearest snapshot before turn (or from where it got to,
+    if that's nearer).  Turn 0 is the board before anyone moves, as it is in
+    the other logs, and turn n the board after n turns. """
+    SNAPSHOT_INTERVAL = 50
+
+    def __init__(self, path, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.header, self.moves = read_orders_replay(path)
+        header = self.header
+        self.map = Map(header['num_hills'], header['hill_size'], header['seed'],
+                       width=header['width'], height=header['height'])
+        if [list(self.map.p1_spawn), list(self.map.p2_spawn)] != [header['p1_spawn'], header['p2_spawn']]:
+            raise ValueError('the map made from the seed is not the one that was played on')
+        self.snapshot_interval = snapshot_interval
+        self.turn = 0
+        self.snapshots = {0: self.__snapshot()}
+
+    def num_turns(self):
+        return len(self.moves)
+
+    def __snapshot(self):
+        m = self.map
+        return (copy.deepcopy(m.p1_guys), copy.deepcopy(m.p2_guys),
+                m.p1_food, m.p2_food, m.p1_money, m.p2_money)
+
+    def __restore(self, snapshot):
+        m = self.map
+        p1_guys, p2_guys, m.p1_food, m.p2_food, m.p1_money, m.p2_money = snapshot
+        m.set_guys(p1_guys, p2_guys)
+
+    def __play_turn(self):
+        """ The engine's steps of a turn, in the same order as game.run_game """
+        m = self.map
+        p1_moves, p2_moves = self.moves[self.turn]
+        m.make_moves(p1_moves, p2_moves)
+        m.resolve_combat()
+        m.give_payouts()
+        m.spawn_new_guys()
+        m.resolve_combat()
+        self.turn += 1
+        if self.turn % self.snapshot_interval == 0 and self.turn not in self.snapshots:
+            self.snapshots[self.turn] = self.__snapshot()
+
+    def seek(self, turn):
+        """ Play the map to the board of turn """
+        if not 0 <= turn <= len(self.moves):
+            raise IndexError('turn %s is not in the log' % turn)
+        nearest = turn - turn % self.snapshot_interval
+        while nearest not in self.snapshots:
+            nearest -= self.snapshot_interval
+        if not nearest <= self.turn <= turn:
+            self.__restore(self.snapshots[nearest])
+            self.turn = nearest
+        while self.turn < turn:
+            self.__play_turn()
+
+    def state(self, turn):
+        """ board_state_for_json() of turn """
+        self.seek(turn)
+        return self.map.board_state_for_json()
+
+    def states(self):
+        """ board_state_for_json() of every turn in order, checking the end
+        money against the log's """
+        for turn in range(len(self.moves) + 1):
+            yield self.state(turn)
+        end = self.header.get('end')
+        if end is not None and [end['p1m'], end['p2m']] != [self.map.p1_money, self.map.p2_money]:
+            raise ValueError('playing the log back gave different money from the game')
+
+
+def convert_to_js(src, dest):
+    """ Write the compact or orders log src out as a viz.html game log """
+    if is_orders_log(src):
+        simulator = ReplaySimulator(src)
+        header, turns = simulator.map.to_struct(), simulator.states()
+        log_header = simulator.header
+    else:
+        header, turns = read_delta_replay(src)
+        del header['version']
+        log_header = header
+    writer = JsReplayWriter(dest, header)
+    for state in turns:
+        writer.write_turn(state)
+    if 'profile' in log_header:
+        writer.write_profile(log_header.pop('profile'))
+    writer.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print "Usage: %s game_log.jsonl[.gz]|game.orders.jsonl[.gz] game_log.js" % sys.argv[0]
+        sys.exit(1)
+    convert_to_js(sys.argv[1], sys.argv[2])
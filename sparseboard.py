@@ -0,0 +1,138 @@
+""" Stand-ins for the per-cell lists of Map on boards too big to store every
+cell of, used when Map is made with sparse=True (or a board over
+Map.SPARSE_ABOVE cells).
+
+They are indexed the same way as the lists they replace - grid[x][y] for a
+grid, table[x * height + y] for a flat table - but are dicts holding only the
+cells that have been used, so the memory and time a game takes go with the
+number of cells the chickens get to rather than the size of the board.
+Cells that are emptied again are kept (as 0), which keeps every lookup and
+update a plain dict operation. """
+import array
+
+
+class SparseColumn(dict):
+    """ One column of a SparseGrid, {y: value}.  Cells never set read as 0. """
+    def __init__(self, height):
+        dict.__init__(self)
+        self.height = height
+
+    def __missing__(self, y):
+        if not 0 <= y < self.height:
+            raise IndexError('cell %s is off the board' % y)
+        return 0
+
+    def __len__(self):
+        return self.height
+
+
+class SparseGrid(dict):
+    """ A width x height [x][y] grid of numbers, zero almost everywhere: a
+    SparseColumn for each x that has been looked at """
+    def __init__(self, width, height, rows=None):
+        """ rows is an optional [x][y] grid (or SparseGrid) to copy """
+        dict.__init__(self)
+        self.width, self.height = width, height
+        if isinstance(rows, SparseGrid):
+            for x, y in rows.cells():
+                self[x][y] = rows[x][y]
+        elif rows is not None:
+            for x, row in enumerate(rows):
+                for y, value in enumerate(row):
+                    if value:
+                        self[x][y] = value
+
+    def __missing__(self, x):
+        if x < 0:
+            return self[x + self.width]
+        if not x < self.width:
+            raise IndexError('column %s is off the board' % x)
+        column = SparseColumn(self.height)
+        dict.__setitem__(self, x, column)
+        return column
+
+    def __len__(self):
+        return self.width
+
+    def __iter__(self):
+        for x in xrange(self.width):
+            yield self[x]
+
+    def cells(self):
+        """ (x, y) of every non-zero cell, in no particular order """
+        return [(x, y) for x, column in self.iteritems()
+                for y, value in column.iteritems() if value]
+
+
+class SparseTable(dict):
+    """ A flat table of numbers, 0 wherever it hasn't been set """
+    def __missing__(self, i):
+        return 0
+
+
+class CellTable(dict):
+    """ A read-only flat table of function(x, y) for every cell, worked out
+    the first time a cell is looked up """
+    def __init__(self, height, function):
+        dict.__init__(self)
+        self.height = height
+        self.function = function
+
+    def __missing__(self, i):
+        x, y = divmod(i, self.height)
+        value = self[i] = self.function(x, y)
+        return value
+
+
+class LazyPayouts:
+    """ money_payout_rates for a big board, looked up like the usual [x][y]
+    list but only worked out a block of columns at a time, the first time
+    something in the block is looked at.
+
+    raw_columns(x0, x1) gives columns x0 to x1 - 1 of the summed hills as
+    lists or arrays.  Normalizing the rates needs the lowest and highest sum
+    on the board, so every column is summed once up front, but none of them
+    are kept. """
+    BLOCK = 64
+
+    def __init__(self, raw_columns, width, height):
+        self.raw_columns = raw_columns
+        self.width, self.height = width, height
+        self.blocks = {}
+        low = high = None
+        for x0 in xrange(0, width, self.BLOCK):
+            for column in raw_columns(x0, min(width, x0 + self.BLOCK)):
+                column_low, column_high = min(column), max(column)
+                if low is None or column_low < low:
+                    low = column_low
+                if high is None or column_high > high:
+                    high = column_high
+        self.low, self.high = low, high
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError('column %s is off the board' % x)
+        block_no, offset = divmod(x, self.BLOCK)
+        block = self.blocks.get(block_no)
+        if block is None:
+            block = self.blocks[block_no] = self.__block(block_no)
+        return block[offset]
+
+    def __iter__(self):
+        for x in xrange(self.width):
+            yield self[x]
+
+    def __block(self, block_no):
+        """ The normalized columns of a block, as arrays of doubles """
+        x0 = block_no * self.BLOCK
+        low, spread = self.low, self.high - self.low
+        columns = []
+        for column in self.raw_columns(x0, min(self.width, x0 + self.BLOCK)):
+            columns.append(array.array('d', [int(1000 * ((value - low) / spread)) / 1000.0
+                                             for value in column]))
+        return columns
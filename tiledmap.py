@@ -0,0 +1,238 @@
+""" A NumpyMap that runs the moves, combat and payouts of each turn on
+several cores, for very big boards.
+
+The board is split into strips of whole columns, one per worker process.
+The guys of both players, and how many guys each player's orders ask to send
+each way from each cell, are kept in shared memory, which the main process
+and every worker see.  Each worker only ever writes its own strip.
+
+    apply_moves     The main process writes out the orders, then each worker
+                    checks the orders of its strip and the column either side
+                    of it (the halo) against the guys there and works out its
+                    strip's new guys, including what moves in from the halo.
+                    Once every worker has finished reading, they all write
+                    their strips.
+    resolve_combat  Each worker fights out its own strip.
+    give_payouts    Each worker adds up the income of its own strip, in
+                    thousandths like Map, and the main process adds those up.
+
+Every step is whole numbers, so the results are exactly those of map.Map.
+Dict orders, which depend on the dict's own order, are checked in the main
+process as usual, and spawning, the turn data and the log are done there too.
+
+python game.py --engine tiled --tiles 8 --size 2000x2000 --log "" mybot1.py mybot2.py
+"""
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+import actions
+import orders
+from map import Map, Income
+from numpymap import NumpyMap, order_records, histogram_array, moved_guys
+
+
+class TileError(Exception):
+    """ A tile worker died """
+    pass
+
+
+def shared_grid(raw, *shape):
+    """ An int64 array of the given shape over a shared RawArray """
+    return np.frombuffer(raw, dtype=np.int64).reshape(shape)
+
+
+def tile_main(conn, raws, request_raws, width, height, x0, x1, milli):
+    """ Runs in a worker: answer the main process's commands for the strip of
+    columns x0 to x1 - 1 until told to stop.  milli is the strip's payout
+    rates in thousandths. """
+    grids = [shared_grid(raw, width, height) for raw in raws]
+    requests = [shared_grid(raw, width, height, len(actions.ALL_ACTIONS))
+                for raw in request_raws]
+    lo, hi = max(0, x0 - 1), min(width, x1 + 1)
+    moved = [None, None]
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        command, args = message
+        if command == 'move':
+            # Work out the new strips, but don't write them while the other
+            # workers may still be reading our edge columns as their halo.
+            # args says which players' orders were written out.
+            for player, requested in enumerate(args):
+                if not requested:
+                    moved[player] = None
+                    continue
+                guys = grids[player][lo:hi]
+                requested = requests[player][lo:hi].copy()
+                moved[player] = moved_guys(guys, requested, lo == 0, hi == width)[x0 - lo:x1 - lo]
+            conn.send(None)
+        elif command == 'commit':
+            for player in (0, 1):
+                if moved[player] is not None:
+                    grids[player][x0:x1] = moved[player]
+                    moved[player] = None
+            conn.send(None)
+        elif command == 'combat':
+            p1_guys, p2_guys = grids[0][x0:x1], grids[1][x0:x1]
+            num_dead = np.minimum(p1_guys, p2_guys)
+            p1_guys -= num_dead
+            p2_guys -= num_dead
+            conn.send(num_dead[num_dead < 0].tolist())
+        elif command == 'income':
+            p1_owned = grids[0][x0:x1] != 0
+            p2_owned = ~p1_owned & (grids[1][x0:x1] != 0)
+            conn.send((int(milli[p1_owned].sum()), int(p1_owned.sum()),
+                       int(milli[p2_owned].sum()), int(p2_owned.sum())))
+
+
+class TiledMap(NumpyMap):
+    """ NumpyMap with each turn's moves, combat and payouts worked out in
+    strips by a pool of worker processes """
+
+    def __init__(self, num_hills=4, hill_size=30, seed=None, cache_dir=None,
+                 width=Map.WIDTH, height=Map.HEIGHT, tiles=None):
+        """ tiles is the number of strips and workers, one per core by
+        default """
+        NumpyMap.__init__(self, num_hills, hill_size, seed, cache_dir, width, height, sparse=None)
+        if tiles is None:
+            tiles = multiprocessing.cpu_count()
+        tiles = max(1, min(tiles, width))
+        self.raws = [multiprocessing.RawArray(ctypes.c_int64, width * height)
+                     for player in (1, 2)]
+        self.p1_guys, self.p2_guys = [shared_grid(raw, width, height) for raw in self.raws]
+        directions = len(actions.ALL_ACTIONS)
+        request_raws = [multiprocessing.RawArray(ctypes.c_int64, width * height * directions)
+                        for player in (1, 2)]
+        self.requests = [shared_grid(raw, width, height, directions) for raw in request_raws]
+        self.__incomes = None
+
+        # Strips of as near the same width as can be
+        self.strips = [(width * i // tiles, width * (i + 1) // tiles) for i in range(tiles)]
+        self.conns = []
+        self.processes = []
+        for x0, x1 in self.strips:
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=tile_main,
+                args=(child_conn, self.raws, request_raws, width, height, x0, x1,
+                      self.milli_array[x0:x1]))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def __command(self, command, args=None):
+        """ Send a command to every worker, args being a list of each one's
+        arguments or None, and return their replies in strip order """
+        for i, conn in enumerate(self.conns):
+            conn.send((command, args[i] if args is not None else None))
+        replies = []
+        for conn in self.conns:
+            try:
+                replies.append(conn.recv())
+            except (EOFError, IOError):
+                raise TileError('a tile worker died')
+        return replies
+
+    def set_guys(self, p1_guys, p2_guys):
+        NumpyMap.set_guys(self, p1_guys, p2_guys)
+        self.__incomes = None
+
+    def undo_turn(self):
+        NumpyMap.undo_turn(self)
+        self.__incomes = None
+
+    def clone(self):
+        """ A NumpyMap copy of the board: the workers and the shared arrays
+        stay with this map """
+        m = NumpyMap.clone(self)
+        m.__class__ = NumpyMap
+        del m.raws, m.requests, m.strips, m.conns, m.processes, m.__incomes
+        return m
+
+    def apply_moves(self, p1_actions, p2_actions):
+        written = [self.__write_requests(self.p1_guys, p1_actions, self.requests[0]),
+                   self.__write_requests(self.p2_guys, p2_actions, self.requests[1])]
+        if any(written):
+            self.__command('move', [written] * len(self.strips))
+            self.__command('commit')
+        self.__incomes = None
+
+    def __write_requests(self, guys, player_orders, requested):
+        """ Write how many guys a player's orders ask to send each way from
+        each cell to requested, for the workers, and return True; or make
+        the moves here and return False, for dict orders (and the odd formats
+        NumpyMap doesn't do with arrays either) """
+        if histogram_array(player_orders, self.width, self.height, requested) is not None:
+            return True
+        records = order_records(player_orders, self.width, self.height)
+        if records is not None:
+            requested.fill(0)
+            xs, ys, directions, quantities = records.T
+            np.add.at(requested, (xs, ys, directions), quantities)
+            return True
+
+        moves = orders.accepted_moves(player_orders, guys, self.width, self.height)
+        if moves:
+            xs, ys, new_xs, new_ys, quantities = zip(*moves)
+            flat = guys.reshape(-1)
+            np.subtract.at(flat, np.array(xs) * self.height + ys, quantities)
+            np.add.at(flat, np.array(new_xs) * self.height + new_ys, quantities)
+        return False
+
+    def resolve_combat(self):
+        for negatives in self.__command('combat'):
+            for n in negatives:
+                print n
+        self.__incomes = None
+
+    def spawn_new_guys(self):
+        NumpyMap.spawn_new_guys(self)
+        self.__incomes = None
+
+    def give_payouts(self):
+        p1_income, p2_income = self.__tile_incomes()
+        if p1_income is not None:
+            self.p1_money += p1_income.money
+            self.p1_food += p1_income.food
+        if p2_income is not None:
+            self.p2_money += p2_income.money
+            self.p2_food += p2_income.food
+
+    def income_for_p1(self):
+        return self.__tile_incomes()[0] or Income(0.0, 0.0)
+
+    def income_for_p2(self):
+        return self.__tile_incomes()[1] or Income(0.0, 0.0)
+
+    def __tile_incomes(self):
+        """ Each player's Income, added up over the strips, or None for a
+        player with no cells.  Kept until the board changes. """
+        if self.__incomes is None:
+            totals = [sum(counts) for counts in zip(*self.__command('income'))]
+            self.__incomes = [self.__income(totals[0], totals[1]),
+                              self.__income(totals[2], totals[3])]
+        return self.__incomes
+
+    def __income(self, milli_money, num_owned):
+        if not num_owned:
+            return None
+        return Income(milli_money / 1000.0, (1000 * num_owned - milli_money) / 1000.0)
+
+    def close(self):
+        """ Stop the workers """
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except IOError:
+                pass # Already gone
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        for conn in self.conns:
+            conn.close()
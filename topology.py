@@ -0,0 +1,72 @@
+""" The shape of a board, worked out once for each size, so loops that walk
+from cell to cell look the next cell up instead of adding offsets and
+checking bounds every step.
+
+Cells are numbered x * height + y, the order Map and distfield.py keep their
+flat tables in.  For a board of a given size, topology_for gives a Topology
+with
+
+    positions   [cell] (x, y) of each cell
+    step        [direction][cell] the cell a move that way lands on, or
+                OFF_BOARD if it would go off the board (STAY lands where it
+                started)
+    neighbours  [cell] tuple of (direction, cell) for each move that stays on
+                the board, in the order of actions.ALL_ACTIONS[1:]
+    grid_neighbours
+                [x][y] the same as (direction, x2, y2), for bots that keep
+                their grids [x][y]
+
+Every map of the same size shares one, so it is made of tuples and must not
+be changed.  The tables have an entry for every cell, so Map only uses them
+on boards that aren't sparse. """
+import actions
+
+# Where a move off the board goes.  No cell has this number.
+OFF_BOARD = -1
+
+MOVE_ACTIONS = actions.ALL_ACTIONS[1:]
+
+_topologies = {}
+
+
+class Topology:
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.size = width * height
+        self.positions = tuple(divmod(i, height) for i in range(self.size))
+
+        step = [None] * len(actions.ALL_ACTIONS)
+        for direction in actions.ALL_ACTIONS:
+            dx, dy = actions.OFFSETS[direction]
+            step[direction] = tuple(
+                (x + dx) * height + y + dy if 0 <= x + dx < width and 0 <= y + dy < height
+                else OFF_BOARD
+                for x, y in self.positions)
+        self.step = tuple(step)
+
+        self.neighbours = tuple(
+            tuple((direction, step[direction][i]) for direction in MOVE_ACTIONS
+                  if step[direction][i] != OFF_BOARD)
+            for i in range(self.size))
+        self.grid_neighbours = tuple(
+            tuple(tuple((direction,) + self.positions[j]
+                        for direction, j in self.neighbours[x * height + y])
+                  for y in range(height))
+            for x in range(width))
+
+    def index(self, x, y):
+        """ The number of cell (x, y) """
+        return x * self.height + y
+
+    def next_cell(self, i, direction):
+        """ The cell a move from cell i goes to, or OFF_BOARD """
+        return self.step[direction][i]
+
+
+def topology_for(width, height):
+    """ The Topology of a width x height board, shared by every board of that
+    size """
+    topology = _topologies.get((width, height))
+    if topology is None:
+        topology = _topologies[width, height] = Topology(width, height)
+    return topology
@@ -0,0 +1,189 @@
+""" Play lots of games between bots at once, spread over a pool of worker
+processes, and print win/loss/money tables.
+
+python tournament.py phoglenix3.py dumbplayer.py randomplayer.py --seeds 10
+
+Every match is played once per seed, with the bots swapping sides on every
+other seed.  Round robin plays every pair of bots; double elimination plays
+the bracket used in the real competition, a bot being knocked out after
+losing two matches. """
+import sys
+import argparse
+import multiprocessing
+from collections import defaultdict
+from itertools import combinations
+
+import game
+
+
+def init_worker():
+    game.PRINT_TRACE = False
+
+
+def run_game(job):
+    """ Worker entry point: play one game, job is
+    (player1, player2, seed, engine, map_cache) """
+    player1, player2, seed, engine, map_cache = job
+    return job, game.play_game(player1, player2, engine=engine, seed=seed,
+                               map_cache=map_cache)
+
+
+class Standings:
+    """ Running totals of every game played in a tournament """
+    def __init__(self, bots):
+        self.bots = bots
+        self.wins = defaultdict(int)
+        self.losses = defaultdict(int)
+        self.ties = defaultdict(int)
+        self.crashes = defaultdict(int)
+        self.money = defaultdict(float)
+        self.games = defaultdict(int)
+        # (bot, opponent) -> games bot won against opponent
+        self.head_to_head = defaultdict(int)
+
+    def add(self, job, result):
+        player1, player2 = job[:2]
+        self.__add_side(player1, player2, result.p1_money, result.p2_money, result.p1_crashed)
+        self.__add_side(player2, player1, result.p2_money, result.p1_money, result.p2_crashed)
+
+    def __add_side(self, bot, opponent, money, their_money, crashed):
+        self.games[bot] += 1
+        self.money[bot] += money
+        if crashed:
+            self.crashes[bot] += 1
+        if money > their_money:
+            self.wins[bot] += 1
+            self.head_to_head[bot, opponent] += 1
+        elif money < their_money:
+            self.losses[bot] += 1
+        else:
+            self.ties[bot] += 1
+
+    def print_tables(self):
+        name_width = max(len(bot) for bot in self.bots) + 2
+        print '%-*s %6s %6s %6s %6s %14s' % (name_width, 'bot', 'won', 'lost', 'tied',
+                                             'crash', 'mean money')
+        ranked = sorted(self.bots, key=lambda bot: (-self.wins[bot], self.losses[bot]))
+        for bot in ranked:
+            mean = self.money[bot] / self.games[bot] if self.games[bot] else 0.0
+            print '%-*s %6d %6d %6d %6d %14.1f' % (name_width, bot, self.wins[bot],
+                self.losses[bot], self.ties[bot], self.crashes[bot], mean)
+        print
+        print 'Games won by row bot against column bot'
+        print ' ' * name_width + ''.join('%*s' % (name_width, bot) for bot in ranked)
+        for bot in ranked:
+            row = ''
+            for opponent in ranked:
+                if bot == opponent:
+                    row += '%*s' % (name_width, '-')
+                else:
+                    row += '%*d' % (name_width, self.head_to_head[bot, opponent])
+            print '%-*s%s' % (name_width, bot, row)
+
+
+class Tournament:
+    def __init__(self, bots, seeds, workers, engine='list', map_cache=None):
+        self.bots = bots
+        self.seeds = seeds
+        self.engine = engine
+        self.map_cache = map_cache
+        self.pool = multiprocessing.Pool(workers, init_worker)
+        self.standings = Standings(bots)
+
+    def match_jobs(self, bot1, bot2):
+        """ One game per seed, swapping sides every other seed """
+        jobs = []
+        for seed in self.seeds:
+            if seed % 2:
+                jobs.append((bot2, bot1, seed, self.engine, self.map_cache))
+            else:
+                jobs.append((bot1, bot2, seed, self.engine, self.map_cache))
+        return jobs
+
+    def play_matches(self, pairs):
+        """ Play all the games of several matches at once.  Returns the winner
+        of each pair: most games won, then most money earned. """
+        jobs = []
+        for bot1, bot2 in pairs:
+            jobs.extend(self.match_jobs(bot1, bot2))
+        wins = defaultdict(int)
+        money = defaultdict(float)
+        for job, result in self.pool.imap_unordered(run_game, jobs):
+            self.standings.add(job, result)
+            player1, player2 = job[:2]
+            if result.p1_money > result.p2_money:
+                wins[player1, player2] += 1
+            elif result.p2_money > result.p1_money:
+                wins[player2, player1] += 1
+            money[player1, player2] += result.p1_money
+            money[player2, player1] += result.p2_money
+        winners = []
+        for bot1, bot2 in pairs:
+            score1 = (wins[bot1, bot2], money[bot1, bot2])
+            score2 = (wins[bot2, bot1], money[bot2, bot1])
+            winners.append(bot1 if score1 >= score2 else bot2)
+        return winners
+
+    def close(self):
+        """ Stop the worker processes, once there are no more games to play """
+        self.pool.close()
+        self.pool.join()
+
+    def round_robin(self):
+        self.play_matches(list(combinations(self.bots, 2)))
+
+    def double_elimination(self):
+        """ Play rounds until only one bot has fewer than two losses.  Each
+        round pairs up the unbeaten bots and the once-beaten bots separately
+        (an odd bot out gets a bye), until it comes down to one of each, who
+        then play the grand final. """
+        losses = dict((bot, 0) for bot in self.bots)
+        round_no = 0
+        while len([bot for bot in self.bots if losses[bot] < 2]) > 1:
+            round_no += 1
+            unbeaten = [bot for bot in self.bots if losses[bot] == 0]
+            beaten_once = [bot for bot in self.bots if losses[bot] == 1]
+            if len(unbeaten) == 1 and len(beaten_once) == 1:
+                pairs = [(unbeaten[0], beaten_once[0])]
+            else:
+                pairs = zip(unbeaten[0::2], unbeaten[1::2])
+                pairs += zip(beaten_once[0::2], beaten_once[1::2])
+            winners = self.play_matches(pairs)
+            for (bot1, bot2), winner in zip(pairs, winners):
+                loser = bot2 if winner == bot1 else bot1
+                losses[loser] += 1
+                print 'Round %d: %s beat %s' % (round_no, winner, loser)
+        champion = [bot for bot in self.bots if losses[bot] < 2][0]
+        print
+        print 'CHAMPION: %s' % champion
+        print
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a tournament between bots.')
+    parser.add_argument('bots', nargs='+', help='bot modules (mybot.py)')
+    parser.add_argument('--seeds', type=int, default=10, help='games per match')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--format', choices=['round-robin', 'double-elimination'],
+                        default='round-robin')
+    parser.add_argument('--engine', choices=['list', 'numpy'], default='list')
+    parser.add_argument('--map-cache', metavar='DIR',
+                        help='directory of cached maps, shared between runs')
+    args = parser.parse_args()
+
+    if len(set(args.bots)) != len(args.bots) or len(args.bots) < 2:
+        print 'Need at least two different bots'
+        sys.exit(1)
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    tournament = Tournament(args.bots, seeds, args.workers, args.engine,
+                            args.map_cache)
+    try:
+        if args.format == 'round-robin':
+            tournament.round_robin()
+        else:
+            tournament.double_elimination()
+    finally:
+        tournament.close()
+    tournament.standings.print_tables()
@@ -0,0 +1,277 @@
+""" Tune a bot's magic numbers: play games with different settings of its
+Player's keyword arguments over a pool of worker processes, and say which
+settings beat the opponent.
+
+python tune.py phoglenix3.py --param attraction=0.05,0.1,0.2 --param stay_after=400,500,600
+
+Every combination of the --param values is a candidate (or --samples of them,
+picked at random).  Each candidate plays the opponent, by default the same
+bot with its usual settings, on the same seeded maps as every other
+candidate, swapping sides every other seed.  After each game a sequential
+probability ratio test on the candidate's wins and losses decides whether
+its win rate is clearly above even (better), clearly not (worse), or needs
+more games, so poor settings are dropped after a handful of games rather
+than a full --max-games.  Ties don't count either way.
+
+The parameters are checked before any games are played: each has to be a
+keyword argument of the bot's Player, and each value inside the range its
+Player's PARAM_RANGES gives it, if any. """
+import sys
+import math
+import random
+import inspect
+import argparse
+import itertools
+import multiprocessing
+from Queue import Queue
+from traceback import format_exc
+
+import game
+
+BETTER = 'better'
+WORSE = 'worse'
+
+
+def init_worker():
+    game.PRINT_TRACE = False
+
+
+def run_game(job):
+    """ Worker entry point: play one game of a candidate, job is
+    (candidate number, bot, params, opponent, seed, engine, map_cache).
+    The candidate is player 1 on even seeds and player 2 on odd ones.
+    Returns (job, (money, their money, crashed), None), or (job, None,
+    traceback) if the game itself broke. """
+    number, bot, params, opponent, seed, engine, map_cache = job
+    try:
+        if seed % 2:
+            result = game.play_game(opponent, bot, engine=engine, seed=seed,
+                                    map_cache=map_cache, p2_params=params)
+            return job, (result.p2_money, result.p1_money, result.p2_crashed), None
+        result = game.play_game(bot, opponent, engine=engine, seed=seed,
+                                map_cache=map_cache, p1_params=params)
+        return job, (result.p1_money, result.p2_money, result.p1_crashed), None
+    except Exception:
+        # Pool.apply_async has no way to hand back an error to a callback
+        return job, None, format_exc()
+
+
+class SequentialTest:
+    """ Wald's sequential probability ratio test of whether a win rate is p1
+    (better) or p0 (no better), wrongly saying better at most alpha of the
+    time and wrongly saying worse at most beta of the time """
+    def __init__(self, p0=0.5, p1=0.65, alpha=0.05, beta=0.05):
+        self.win_step = math.log(p1 / p0)
+        self.loss_step = math.log((1 - p1) / (1 - p0))
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    def verdict(self, wins, losses):
+        """ BETTER, WORSE, or None if it can't tell yet """
+        ratio = wins * self.win_step + losses * self.loss_step
+        if ratio >= self.upper:
+            return BETTER
+        if ratio <= self.lower:
+            return WORSE
+        return None
+
+
+class Candidate:
+    """ One setting of the parameters and how its games went """
+    def __init__(self, number, params):
+        self.number = number
+        self.params = params
+        self.wins = 0
+        self.losses = 0
+        self.ties = 0
+        self.crashes = 0
+        self.margin = 0.0 # Money over the opponent's, added up
+        self.started = 0 # Games handed out, including those still being played
+        self.verdict = None
+
+    def games(self):
+        return self.wins + self.losses + self.ties
+
+    def add(self, money, their_money, crashed):
+        if money > their_money:
+            self.wins += 1
+        elif money < their_money:
+            self.losses += 1
+        else:
+            self.ties += 1
+        if crashed:
+            self.crashes += 1
+        self.margin += money - their_money
+
+    def describe(self):
+        return ', '.join('%s=%s' % (name, self.params[name]) for name in sorted(self.params))
+
+
+class Tuner:
+    def __init__(self, bot, opponent, candidates, seeds, workers, test,
+                 engine='list', map_cache=None, verbose=True):
+        self.bot = bot
+        self.opponent = opponent
+        self.candidates = [Candidate(i, params) for i, params in enumerate(candidates)]
+        self.seeds = seeds
+        self.workers = workers
+        self.test = test
+        self.engine = engine
+        self.map_cache = map_cache
+        self.verbose = verbose
+
+    def __next_job(self):
+        """ The next game to play: the next seed of the undecided candidate
+        with the fewest games handed out, or None once there are none """
+        waiting = [c for c in self.candidates
+                   if c.verdict is None and c.started < len(self.seeds)]
+        if not waiting:
+            return None
+        candidate = min(waiting, key=lambda c: (c.started, c.number))
+        seed = self.seeds[candidate.started]
+        candidate.started += 1
+        return (candidate.number, self.bot, candidate.params, self.opponent, seed,
+                self.engine, self.map_cache)
+
+    def run(self):
+        """ Play games until every candidate is decided or has played every
+        seed.  Games of a candidate that are still being played when it is
+        decided are finished and counted, but no more are started. """
+        pool = multiprocessing.Pool(self.workers, init_worker)
+        results = Queue()
+        in_flight = 0
+        try:
+            # Keep a couple of games per worker queued up
+            while True:
+                while in_flight < 2 * self.workers:
+                    job = self.__next_job()
+                    if job is None:
+                        break
+                    pool.apply_async(run_game, (job,), callback=results.put)
+                    in_flight += 1
+                if not in_flight:
+                    break
+                # (A timeout keeps the wait open to Ctrl-C)
+                job, outcome, error = results.get(timeout=7 * 24 * 3600)
+                in_flight -= 1
+                if error is not None:
+                    raise RuntimeError('game of seed %d failed:\n%s' % (job[4], error))
+                candidate = self.candidates[job[0]]
+                candidate.add(*outcome)
+                if candidate.verdict is None:
+                    candidate.verdict = self.test.verdict(candidate.wins, candidate.losses)
+                    if candidate.verdict is not None and self.verbose:
+                        print '%s after %d games (%d-%d): %s' % (
+                            candidate.verdict, candidate.games(), candidate.wins,
+                            candidate.losses, candidate.describe())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def print_table(self):
+        """ The candidates, best first: better ones, then undecided, then
+        worse, each by win rate and then money margin """
+        order = {BETTER: 0, None: 1, WORSE: 2}
+        def key(c):
+            decided = c.wins + c.losses
+            rate = float(c.wins) / decided if decided else 0.5
+            margin = c.margin / c.games() if c.games() else 0.0
+            return (order[c.verdict], -rate, -margin)
+        print '%-10s %6s %6s %6s %6s %6s %14s  %s' % ('verdict', 'games', 'won', 'lost',
+                                                     'tied', 'crash', 'mean margin', 'params')
+        for c in sorted(self.candidates, key=key):
+            margin = c.margin / c.games() if c.games() else 0.0
+            print '%-10s %6d %6d %6d %6d %6d %14.1f  %s' % (c.verdict or 'undecided',
+                c.games(), c.wins, c.losses, c.ties, c.crashes, margin, c.describe())
+
+
+def check_params(bot, params):
+    """ What's wrong with trying the (name, [values]) in params on bot, as
+    a list of messages: names that aren't keyword arguments of its Player,
+    and values outside the Player's PARAM_RANGES """
+    Player = game.load_player(bot)
+    problems = []
+    names = inspect.getargspec(Player.__init__).args
+    ranges = getattr(Player, 'PARAM_RANGES', {})
+    for name, values in params:
+        if name not in names:
+            problems.append('%s has no parameter %s' % (bot, name))
+            continue
+        low, high = ranges.get(name, (None, None))
+        for value in values:
+            if (low is not None and value < low) or (high is not None and value > high):
+                problems.append('%s=%s is outside %s to %s' % (
+                    name, value, 'any' if low is None else low, 'any' if high is None else high))
+    return problems
+
+
+def param_values(text):
+    """ (name, [values]) from name=v1,v2,... with whole numbers as ints """
+    name, sep, values = text.partition('=')
+    if not sep or not name or not values:
+        raise argparse.ArgumentTypeError('%r is not like name=1,2,3' % text)
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(int(value))
+        except ValueError:
+            try:
+                parsed.append(float(value))
+            except ValueError:
+                raise argparse.ArgumentTypeError('%r is not a number' % value)
+    return name, parsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tune a bot's parameters.")
+    parser.add_argument('bot', help='bot module (mybot.py) whose Player takes the parameters')
+    parser.add_argument('--param', type=param_values, action='append', default=[],
+                        metavar='NAME=V1,V2,...', help='values to try for a parameter')
+    parser.add_argument('--opponent', help='bot to play against (the bot itself, with its '
+                                           'usual settings, if not given)')
+    parser.add_argument('--samples', type=int,
+                        help='try this many combinations, picked at random, instead of all')
+    parser.add_argument('--max-games', type=int, default=100,
+                        help='most games any candidate plays')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--p0', type=float, default=0.5,
+                        help='win rate of a candidate that is no better')
+    parser.add_argument('--p1', type=float, default=0.65,
+                        help='win rate of a candidate that is better')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='chance of calling a candidate that is no better better')
+    parser.add_argument('--beta', type=float, default=0.05,
+                        help='chance of calling a better candidate worse')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--engine', choices=['list', 'numpy'], default='list')
+    parser.add_argument('--map-cache', metavar='DIR',
+                        help='directory of cached maps, shared between runs')
+    args = parser.parse_args()
+
+    if not args.param:
+        print 'Give at least one --param to tune'
+        sys.exit(1)
+    if not args.bot.endswith('.py'):
+        print 'Can only tune a bot module (mybot.py)'
+        sys.exit(1)
+    problems = check_params(args.bot, args.param)
+    if problems:
+        print '\n'.join(problems)
+        sys.exit(1)
+    if not 0 < args.p0 < args.p1 < 1:
+        print 'Need 0 < p0 < p1 < 1'
+        sys.exit(1)
+
+    names = [name for name, values in args.param]
+    candidates = [dict(zip(names, values))
+                  for values in itertools.product(*[values for name, values in args.param])]
+    if args.samples is not None and args.samples < len(candidates):
+        candidates = random.Random(args.first_seed).sample(candidates, args.samples)
+    seeds = range(args.first_seed, args.first_seed + args.max_games)
+    test = SequentialTest(args.p0, args.p1, args.alpha, args.beta)
+    tuner = Tuner(args.bot, args.opponent or args.bot, candidates, seeds, args.workers,
+                  test, args.engine, args.map_cache)
+    print '%d candidates, up to %d games each' % (len(candidates), len(seeds))
+    tuner.run()
+    print
+    tuner.print_table()